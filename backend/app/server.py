@@ -1,10 +1,26 @@
-from fastapi import FastAPI, File, HTTPException
-from fastapi.responses import RedirectResponse
-from service.splitter import load_and_split_text, vectorize_docs
-from service.grobid import grobid_parse_pdf
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from service.splitter import load_and_split_text, iter_split_text, vectorize_docs
+from service.grobid import get_grobid_client, close_grobid_client
+from service.ingestion import get_ingestion_pipeline, spool_upload
+from service.embedding_cache import get_embedding_cache
+from service.jobs import get_job_registry, run_in_background
+from service.knowledge_injection import get_knowledge_cache, inject_knowledge_document
+from service.llm_cache import get_llm_cache
+from service.language_model_connection import LanguageModel, get_chain_stats, get_language_model_connection, load_prompts
+from service.weaviate_connection import close_weaviate_connection
 from typing import Annotated
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_grobid_client()
+    await close_weaviate_connection()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 async def redirect_root_to_docs():
@@ -15,23 +31,144 @@ async def create_upload_file(file: Annotated[bytes, File()]):
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
     else:
-        xml = grobid_parse_pdf(file)
+        xml = await get_grobid_client().process_fulltext_document(file)
         return {"xml": xml}
 
+@app.post("/documents/batch", status_code=202)
+async def create_batch_ingestion(files: list[UploadFile], chunk_size: int, chunk_overlap: int, splitter_type: str,
+                                 vectorizer: str, openai_key: str | None = None):
+    if not files:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    if vectorizer == "OpenAI Embeddings" and openai_key is None:
+        raise HTTPException(status_code=400, detail="OpenAI key is required for OpenAI Embeddings.")
+    # spool to disk, every PDF is read again only when it reaches the GROBID stage
+    uploads = [(file.filename or f"document_{i}", await asyncio.to_thread(spool_upload, file.file)) for i, file in enumerate(files)]
+    job = get_job_registry().create("batch_ingestion", items=[{"title": title, "stage": "queued"} for title, _ in uploads])
+    get_ingestion_pipeline().start(job, uploads, chunk_size, chunk_overlap, splitter_type, vectorizer, openai_key)
+    return {"job_id": job.id}
+
+@app.get("/documents/batch/{job_id}")
+async def get_batch_ingestion(job_id: str):
+    return __get_job(job_id, "batch_ingestion").to_dict()
+
 @app.post("/chunks/")
-async def create_chunks(file: Annotated[bytes, File()], chunk_size: int, chunk_overlap: int, splitter_type: str):
+async def create_chunks(file: Annotated[bytes, File()], chunk_size: int, chunk_overlap: int, splitter_type: str, stream: bool = False):
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
+    elif stream:
+        # one JSON record per line, sent as soon as the splitter produces the chunk
+        return StreamingResponse(__iter_chunk_records(file, chunk_size, chunk_overlap, splitter_type), media_type="application/x-ndjson")
     else:
         chunks = load_and_split_text(file, chunk_size, chunk_overlap, splitter_type)
         return {"chunks": chunks}
     
 @app.post("/embeddings/", status_code=201)
-async def create_embeddings(docs:list, vectorizer:str, openai_key:str| None = None, title:str = "dummy"):
+async def create_embeddings(docs:list[str], vectorizer:str, openai_key:str| None = None, title:str = "dummy", background:bool = False):
     if vectorizer == "OpenAI Embeddings" and openai_key is None:
         raise HTTPException(status_code=400, detail="OpenAI key is required for OpenAI Embeddings.")
-    vectorize_docs(docs, vectorizer, openai_key, title)
-    return {"message": "Embeddings stored in weaviate database."}
+    if background:
+        job = get_job_registry().create("embeddings", progress={"total": len(docs), "embedded": 0, "stored": 0})
+        run_in_background(job, __store_embeddings, docs, vectorizer, openai_key, title, job.increment)
+        return JSONResponse(status_code=202, content={"job_id": job.id})
+    result = vectorize_docs(docs, vectorizer, openai_key, title)
+    if result["failed"]:
+        return JSONResponse(status_code=207, content={"message": "Some embeddings could not be stored.", **result})
+    return {"message": "Embeddings stored in weaviate database.", **result}
+
+@app.get("/embeddings/jobs/{job_id}")
+async def get_embeddings_job(job_id: str):
+    return __get_job(job_id, "embeddings").to_dict()
+
+@app.get("/embeddings/jobs/{job_id}/result")
+async def get_embeddings_job_result(job_id: str):
+    job = __get_job(job_id, "embeddings")
+    if not job.finished:
+        raise HTTPException(status_code=409, detail="Job is not finished yet")
+    return job.to_dict(include_result=True)
+
+@app.get("/embeddings/cache/stats")
+async def get_embedding_cache_stats():
+    cache = get_embedding_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Embedding cache is disabled")
+    return cache.stats()
+
+@app.get("/knowledge/cache/stats")
+async def get_knowledge_cache_stats():
+    return get_knowledge_cache().stats()
+
+@app.post("/summaries/stream")
+async def create_summary_stream(file: Annotated[bytes, File()], chunk_size: int, chunk_overlap: int, splitter_type: str,
+                                model: str, knowledge_level: str, openai_key: str | None = None,
+                                inject_knowledge: bool = True, mode: str = "reduce"):
+    if not file:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    if model not in [language_model.value for language_model in LanguageModel]:
+        raise HTTPException(status_code=400, detail=f"Unknown model {model}.")
+    if f"{knowledge_level}_Knowledge" not in load_prompts():
+        raise HTTPException(status_code=400, detail=f"Unknown knowledge level {knowledge_level}.")
+    if mode not in ("sequential", "reduce"):
+        raise HTTPException(status_code=400, detail=f"Unknown summary mode {mode}.")
+    if LanguageModel(model) != LanguageModel.LLAMA2 and openai_key is None:
+        raise HTTPException(status_code=400, detail="OpenAI key is required for OpenAI models.")
+    connection = get_language_model_connection(LanguageModel(model), openai_key)
+    # every chunk summary is sent as soon as it is done, the policy summary last
+    return StreamingResponse(
+        __iter_summary_events(connection, file, chunk_size, chunk_overlap, splitter_type, knowledge_level, inject_knowledge, mode),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/llm/cache/stats")
+async def get_llm_cache_stats():
+    cache = get_llm_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="LLM cache is disabled")
+    return cache.stats()
+
+@app.get("/llm/chains/stats")
+async def get_llm_chain_stats():
+    return get_chain_stats()
+
+def __iter_chunk_records(file:bytes, chunk_size:int, chunk_overlap:int, splitter_type:str):
+    for position, chunk in enumerate(iter_split_text(file, chunk_size, chunk_overlap, splitter_type)):
+        yield json.dumps({"position": position, "size": len(chunk), "chunk": chunk}) + "\n"
+
+async def __iter_summary_events(connection, file:bytes, chunk_size:int, chunk_overlap:int, splitter_type:str,
+                                knowledge_level:str, inject_knowledge:bool, mode:str):
+    try:
+        chunks = await asyncio.to_thread(load_and_split_text, file, chunk_size, chunk_overlap, splitter_type)
+        if inject_knowledge:
+            chunks = await asyncio.to_thread(inject_knowledge_document, chunks)
+        yield __sse_event("chunks", {"total": len(chunks)})
+
+        summaries = [None] * len(chunks)
+        async for position, summary in connection.aiter_chunk_summaries(chunks):
+            summaries[position] = summary
+            yield __sse_event("chunk_summary", {"position": position, "summary": summary})
+
+        if mode == "reduce":
+            summary = await connection.agenerate_policy_summary(summaries, knowledge_level)
+        else:
+            summary = await asyncio.to_thread(connection.generate_policy_summary, summaries, knowledge_level)
+        yield __sse_event("summary", {"summary": summary})
+    except Exception as e:
+        yield __sse_event("error", {"detail": str(e)})
+
+def __sse_event(event:str, data:dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def __store_embeddings(docs:list, vectorizer:str, openai_key:str|None, title:str, progress):
+    result = vectorize_docs(docs, vectorizer, openai_key, title, progress)
+    if result["failed"]:
+        return {"message": "Some embeddings could not be stored.", **result}
+    return {"message": "Embeddings stored in weaviate database.", **result}
+
+def __get_job(job_id:str, kind:str):
+    job = get_job_registry().get(job_id)
+    if job is None or job.kind != kind:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 if __name__ == "__main__":
     import uvicorn
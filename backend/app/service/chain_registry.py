@@ -0,0 +1,93 @@
+import threading
+import time
+from langchain_core.runnables import RunnableLambda
+
+class ChainRegistry:
+    """
+    Builds every chain of a language model connection once and records how it is used.
+
+    Chains are built on first use and shared between threads afterwards. Every call of a
+    registered chain is counted together with its latency.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty ChainRegistry object.
+        """
+        self._entries = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, name:str, build, wrap=None):
+        """
+        Returns a registered entry, building it on first use.
+
+        Args:
+            name (str): The name of the chain.
+            build (Callable[[], tuple]): Builds the (prompt, chain) entry.
+            wrap (Callable, optional): Wraps the timed chain given the prompt and the chain, e.g. with a
+                response cache, so calls answered by the wrapper are not timed. Defaults to no wrapper.
+
+        Returns:
+            tuple: The prompt template and the timed chain.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is None:
+                    prompt, chain = build()
+                    chain = self.__timed(name, chain)
+                    entry = (prompt, wrap(prompt, chain) if wrap else chain)
+                    self._entries[name] = entry
+        return entry
+
+    def stats(self):
+        """
+        Returns the call counts and latencies of the chains.
+
+        Returns:
+            dict: calls, failures, total, mean and maximum seconds per chain name.
+        """
+        with self._lock:
+            return {
+                name: {**stats, "mean_seconds": stats["total_seconds"] / stats["calls"] if stats["calls"] else 0.0}
+                for name, stats in self._stats.items()
+            }
+
+    def __timed(self, name:str, chain):
+        """
+        Wraps a chain so every call is recorded, batches record each of their inputs.
+        """
+        def invoke(inputs, config):
+            start = time.perf_counter()
+            try:
+                result = chain.invoke(inputs, config)
+            except Exception:
+                self.__record(name, time.perf_counter() - start, failed=True)
+                raise
+            self.__record(name, time.perf_counter() - start)
+            return result
+
+        async def ainvoke(inputs, config):
+            start = time.perf_counter()
+            try:
+                result = await chain.ainvoke(inputs, config)
+            except Exception:
+                self.__record(name, time.perf_counter() - start, failed=True)
+                raise
+            self.__record(name, time.perf_counter() - start)
+            return result
+
+        return RunnableLambda(invoke, afunc=ainvoke, name=name)
+
+    def __record(self, name:str, seconds:float, failed:bool = False):
+        """
+        Adds a call to the statistics of a chain.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "failures": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["failures"] += failed
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
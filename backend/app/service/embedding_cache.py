@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+import threading
+import numpy as np
+from service.etc.settings import get_setting
+from service.persistent_cache import PersistentCache
+
+class EmbeddingCache:
+    """
+    A persistent cache of chunk embeddings keyed by vectorizer and SHA-256 of the chunk text.
+
+    Vectors are stored as float32 blobs in a local SQLite file, so re-embedding byte-identical
+    chunks after changing the chunk size or the splitter costs no model calls.
+    """
+
+    def __init__(self, path:str|None = None, max_bytes:int|None = None):
+        """
+        Initializes an EmbeddingCache object. Missing arguments are read from the environment.
+
+        Args:
+            path (str, optional): The SQLite file (EMBEDDING_CACHE_PATH). Defaults to embedding_cache.sqlite in the temp directory.
+            max_bytes (int, optional): Maximum size of the stored vectors (EMBEDDING_CACHE_MAX_BYTES). Defaults to 1 GiB.
+        """
+        path = path or get_setting("EMBEDDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "embedding_cache.sqlite"))
+        max_bytes = max_bytes if max_bytes is not None else get_setting("EMBEDDING_CACHE_MAX_BYTES", 1024 ** 3, int)
+        self.cache = PersistentCache(path, max_bytes)
+
+    @staticmethod
+    def make_key(vectorizer:str, chunk:str):
+        """
+        Computes the cache key of a chunk embedded with the given vectorizer.
+
+        Args:
+            vectorizer (str): The vectorizer.
+            chunk (str): The chunk text.
+
+        Returns:
+            str: The cache key.
+        """
+        return f"{vectorizer}:{hashlib.sha256(chunk.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, vectorizer:str, docs:list):
+        """
+        Returns the cached embeddings of the chunks.
+
+        Args:
+            vectorizer (str): The vectorizer.
+            docs (list): The chunks.
+
+        Returns:
+            list: The float32 embedding of each chunk, None for chunks that are not cached.
+        """
+        values = self.cache.get_many([self.make_key(vectorizer, doc) for doc in docs])
+        return [None if value is None else self.__decode(value) for value in values]
+
+    def put_many(self, vectorizer:str, docs:list, embeddings:list):
+        """
+        Stores the embeddings of the chunks.
+
+        Args:
+            vectorizer (str): The vectorizer.
+            docs (list): The chunks.
+            embeddings (np.ndarray | list): The embedding of each chunk.
+        """
+        self.cache.put_many([(self.make_key(vectorizer, doc), self.__encode(embedding)) for doc, embedding in zip(docs, embeddings)])
+
+    def stats(self):
+        """
+        Returns the hit and miss counts and the size of the cache.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        return self.cache.stats()
+
+    @staticmethod
+    def __encode(embedding):
+        """
+        Encodes an embedding as float32 blob.
+        """
+        return np.asarray(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def __decode(value:bytes):
+        """
+        Decodes a float32 blob to a read-only view of the embedding.
+        """
+        return np.frombuffer(value, dtype=np.float32)
+
+__embedding_cache = None
+__embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """
+    Returns the EmbeddingCache shared by the process, or None if caching is disabled (EMBEDDING_CACHE=0).
+
+    Returns:
+        EmbeddingCache: The shared cache.
+    """
+    global __embedding_cache
+    with __embedding_cache_lock:
+        if __embedding_cache is None and get_setting("EMBEDDING_CACHE", 1, int):
+            __embedding_cache = EmbeddingCache()
+        return __embedding_cache
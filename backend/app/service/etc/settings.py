@@ -0,0 +1,34 @@
+import os
+from functools import lru_cache
+from dotenv import load_dotenv, find_dotenv
+
+@lru_cache(maxsize=None)
+def load_env():
+    """
+    Loads the .env file once per process.
+    """
+    load_dotenv(find_dotenv())
+
+def get_setting(name:str, default=None, cast=str):
+    """
+    Reads a setting from the environment (or .env file).
+
+    Args:
+        name (str): The name of the environment variable.
+        default (optional): The value used if the variable is missing or empty.
+        cast (callable, optional): Converts the raw string, e.g. int or float. Defaults to str.
+
+    Raises:
+        ValueError: If the value cannot be converted.
+
+    Returns:
+        The converted value or the default.
+    """
+    load_env()
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid value for {name}: {value!r}") from e
@@ -0,0 +1,140 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import eurlex
+from service.etc.settings import get_setting
+
+class EurLexFetcher(ABC):
+    """
+    A source for the EUR-Lex HTML of regulations.
+
+    Subclasses implement fetch_html, fetch_many resolves many notations concurrently on a
+    bounded worker pool.
+    """
+
+    def __init__(self, max_workers:int|None = None):
+        """
+        Initializes an EurLexFetcher object.
+
+        Args:
+            max_workers (int, optional): Notations resolved at once (EURLEX_MAX_WORKERS). Defaults to 8.
+        """
+        self.max_workers = max_workers or get_setting("EURLEX_MAX_WORKERS", 8, int)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="eurlex")
+
+    @abstractmethod
+    def fetch_html(self, slash_notation:str):
+        """
+        Returns the HTML of a regulation.
+
+        Args:
+            slash_notation (str): The slash notation of the regulation.
+
+        Returns:
+            str: The HTML document.
+        """
+
+    def fetch_many(self, slash_notations:list):
+        """
+        Returns the HTML of many regulations, fetched concurrently.
+
+        Args:
+            slash_notations (list): The slash notations of the regulations.
+
+        Returns:
+            dict: The HTML document of each notation, or the exception raised while fetching it.
+        """
+        futures = {slash_notation: self._executor.submit(self.fetch_html, slash_notation)
+                   for slash_notation in dict.fromkeys(slash_notations)}
+        results = {}
+        for slash_notation, future in futures.items():
+            try:
+                results[slash_notation] = future.result()
+            except Exception as e:
+                results[slash_notation] = e
+        return results
+
+    def close(self):
+        """
+        Shuts down the worker pool, fetches already running are finished first.
+        """
+        self._executor.shutdown(wait=True)
+
+class RemoteEurLexFetcher(EurLexFetcher):
+    """
+    Fetches regulations from the public EUR-Lex service.
+    """
+
+    def __init__(self, max_workers:int|None = None, timeout:float|None = None):
+        """
+        Initializes a RemoteEurLexFetcher object.
+
+        Args:
+            max_workers (int, optional): Notations resolved at once (EURLEX_MAX_WORKERS). Defaults to 8.
+            timeout (float, optional): Seconds per request (EURLEX_TIMEOUT). Defaults to 30.
+        """
+        super().__init__(max_workers)
+        self.timeout = timeout if timeout is not None else get_setting("EURLEX_TIMEOUT", 30.0, float)
+
+    def fetch_html(self, slash_notation:str):
+        celex = eurlex.get_celex_id(slash_notation=slash_notation)
+        return eurlex.get_html_by_celex_id(celex, timeout=self.timeout)
+
+class LocalEurLexFetcher(EurLexFetcher):
+    """
+    Reads regulations from a local directory of EUR-Lex HTML files, e.g. for tests and
+    air-gapped deployments. Files are named after the CELEX id (32009R0078.html) or the
+    slash notation with the slash replaced (78_2009.html).
+    """
+
+    def __init__(self, directory:str, max_workers:int|None = None):
+        """
+        Initializes a LocalEurLexFetcher object.
+
+        Args:
+            directory (str): The directory of the HTML files.
+            max_workers (int, optional): Notations resolved at once (EURLEX_MAX_WORKERS). Defaults to 8.
+        """
+        super().__init__(max_workers)
+        self.directory = directory
+
+    def fetch_html(self, slash_notation:str):
+        celex = eurlex.get_celex_id(slash_notation=slash_notation)
+        for name in (celex, slash_notation.replace("/", "_")):
+            path = os.path.join(self.directory, f"{name}.html")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as file:
+                    return file.read()
+        raise FileNotFoundError(f"No local EurLex document for {slash_notation} in {self.directory}")
+
+__eurlex_fetcher = None
+__eurlex_fetcher_lock = threading.Lock()
+
+def get_eurlex_fetcher():
+    """
+    Returns the EurLexFetcher of the process, a LocalEurLexFetcher if EURLEX_LOCAL_DIR is set,
+    a RemoteEurLexFetcher otherwise.
+
+    Returns:
+        EurLexFetcher: The shared fetcher.
+    """
+    global __eurlex_fetcher
+    with __eurlex_fetcher_lock:
+        if __eurlex_fetcher is None:
+            local_dir = get_setting("EURLEX_LOCAL_DIR")
+            __eurlex_fetcher = LocalEurLexFetcher(local_dir) if local_dir else RemoteEurLexFetcher()
+        return __eurlex_fetcher
+
+def set_eurlex_fetcher(fetcher:EurLexFetcher):
+    """
+    Replaces the EurLexFetcher of the process and closes the previous one.
+
+    Args:
+        fetcher (EurLexFetcher): The fetcher to use from now on.
+    """
+    global __eurlex_fetcher
+    with __eurlex_fetcher_lock:
+        previous, __eurlex_fetcher = __eurlex_fetcher, fetcher
+    if previous is not None and previous is not fetcher:
+        previous.close()
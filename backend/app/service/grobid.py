@@ -1,22 +1,164 @@
+import asyncio
+import random
+import httpx
 import requests
-import os
-from dotenv import load_dotenv, find_dotenv
+from service.etc.settings import get_setting
+from service.tei_cache import TEICache, get_tei_cache
 
-def grobid_parse_pdf(pdf_file: bytes):
+class GrobidClient:
     """
-    Parses a PDF file using the GROBID service.
+    An asynchronous client for the GROBID service.
+
+    The client keeps a pooled connection for the lifetime of the process, caps the number
+    of requests in flight and retries requests that GROBID rejects with 503 because its own
+    queue is full.
+    """
+
+    def __init__(self, grobid_url:str|None = None, timeout:float|None = None, connect_timeout:float|None = None,
+                 max_concurrency:int|None = None, max_retries:int|None = None, backoff_factor:float|None = None,
+                 cache:TEICache|None = None):
+        """
+        Initializes a GrobidClient object. Missing arguments are read from the environment.
+
+        Args:
+            grobid_url (str, optional): The GROBID base URL (GROBID_URL).
+            timeout (float, optional): Seconds to wait for a parsed document (GROBID_TIMEOUT). Defaults to 300.
+            connect_timeout (float, optional): Seconds to wait for a connection (GROBID_CONNECT_TIMEOUT). Defaults to 10.
+            max_concurrency (int, optional): Maximum requests in flight (GROBID_MAX_CONCURRENCY). Defaults to 4.
+            max_retries (int, optional): Retries on 503 responses (GROBID_MAX_RETRIES). Defaults to 5.
+            backoff_factor (float, optional): Base delay in seconds of the exponential backoff (GROBID_BACKOFF). Defaults to 1.
+            cache (TEICache, optional): Cache for parsed documents. Defaults to no caching.
+
+        Raises:
+            ValueError: If the GROBID URL is missing.
+        """
+        self.grobid_url = grobid_url or get_setting("GROBID_URL")
+        if not self.grobid_url:
+            raise ValueError("GROBID URL is missing, please specify in .env file.")
+        self.timeout = timeout if timeout is not None else get_setting("GROBID_TIMEOUT", 300.0, float)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else get_setting("GROBID_CONNECT_TIMEOUT", 10.0, float)
+        self.max_concurrency = max_concurrency or get_setting("GROBID_MAX_CONCURRENCY", 4, int)
+        self.max_retries = max_retries if max_retries is not None else get_setting("GROBID_MAX_RETRIES", 5, int)
+        self.backoff_factor = backoff_factor if backoff_factor is not None else get_setting("GROBID_BACKOFF", 1.0, float)
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._client = None
+
+    async def process_fulltext_document(self, pdf_file:bytes, options:dict|None = None):
+        """
+        Parses a PDF file using the GROBID service, serving repeated documents from the cache.
+
+        Args:
+            pdf_file (bytes): The PDF file to be parsed.
+            options (dict, optional): Additional GROBID form parameters, e.g. {"consolidateHeader": "1"}.
+
+        Raises:
+            httpx.HTTPStatusError: If GROBID answers with an error or stays busy after all retries.
+
+        Returns:
+            str: The extracted TEI XML.
+        """
+        if self.cache is not None:
+            key = TEICache.make_key(pdf_file, options)
+            tei = await asyncio.to_thread(self.cache.get, key)
+            if tei is not None:
+                return tei
+
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                response = await self.__get_client().post("/api/processFulltextDocument", files={"input": pdf_file}, data=options)
+            if response.status_code != 503 or attempt == self.max_retries:
+                break
+            # GROBID is busy, wait without holding a slot
+            await asyncio.sleep(self.__get_backoff(attempt, response))
+        response.raise_for_status()
+
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, response.text)
+        return response.text
+
+    async def aclose(self):
+        """
+        Closes the pooled connections.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def __get_client(self):
+        """
+        Returns the pooled HTTP client, creating it on first use.
+
+        Returns:
+            httpx.AsyncClient: The HTTP client.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.grobid_url,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            )
+        return self._client
+
+    def __get_backoff(self, attempt:int, response:httpx.Response):
+        """
+        Computes the delay before the next attempt, honoring a Retry-After header.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * 2 ** attempt + random.uniform(0, self.backoff_factor)
+
+__grobid_client = None
+
+def get_grobid_client():
+    """
+    Returns the GrobidClient shared by the process.
+
+    Returns:
+        GrobidClient: The shared client.
+    """
+    global __grobid_client
+    if __grobid_client is None:
+        __grobid_client = GrobidClient(cache=get_tei_cache())
+    return __grobid_client
+
+async def close_grobid_client():
+    """
+    Closes the GrobidClient shared by the process, if it was created.
+    """
+    if __grobid_client is not None:
+        await __grobid_client.aclose()
+
+def grobid_parse_pdf(pdf_file: bytes, options:dict|None = None):
+    """
+    Parses a PDF file using the GROBID service, blocking until the result is available.
+    Use GrobidClient inside async code.
 
     Args:
         pdf_file (bytes): The PDF file to be parsed.
+        options (dict, optional): Additional GROBID form parameters.
 
     Returns:
         str: The extracted XML from the GROBID service response.
     """
-    # get from env
-    load_dotenv(find_dotenv())
-    grobid_url = os.environ.get("GROBID_URL")
+    cache = get_tei_cache()
+    if cache is not None:
+        key = TEICache.make_key(pdf_file, options)
+        tei = cache.get(key)
+        if tei is not None:
+            return tei
+
+    grobid_url = get_setting("GROBID_URL")
+    timeout = (get_setting("GROBID_CONNECT_TIMEOUT", 10.0, float), get_setting("GROBID_TIMEOUT", 300.0, float))
     url = f"{grobid_url}/api/processFulltextDocument"
     files = {"input": pdf_file}
-    response = requests.post(url, files=files)
+    response = requests.post(url, files=files, data=options, timeout=timeout)
     response.raise_for_status()
-    return response
\ No newline at end of file
+
+    if cache is not None:
+        cache.put(key, response.text)
+    return response.text
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from service.etc.settings import get_setting
+from service.grobid import GrobidClient, get_grobid_client
+from service.jobs import Job
+from service.splitter import load_and_split_text, embed_docs, store_docs
+
+class IngestionPipeline:
+    """
+    Runs GROBID, chunking, embedding and storing for many PDF files concurrently.
+
+    Every stage has its own concurrency limit, so slow stages do not starve the others. The
+    GROBID stage is limited by the GrobidClient, the CPU and I/O bound stages run in worker threads.
+    Uploaded PDFs wait on disk and are only read once their document reaches the GROBID stage.
+    """
+
+    def __init__(self, grobid_client:GrobidClient|None = None, chunk_concurrency:int|None = None,
+                 embed_concurrency:int|None = None, store_concurrency:int|None = None):
+        """
+        Initializes an IngestionPipeline object. Missing limits are read from the environment.
+
+        Args:
+            grobid_client (GrobidClient, optional): The GROBID client. Defaults to the shared client.
+            chunk_concurrency (int, optional): Documents split at once (INGEST_CHUNK_CONCURRENCY). Defaults to 2.
+            embed_concurrency (int, optional): Documents embedded at once (INGEST_EMBED_CONCURRENCY). Defaults to 4.
+            store_concurrency (int, optional): Documents stored at once (INGEST_STORE_CONCURRENCY). Defaults to 4.
+        """
+        self.grobid_client = grobid_client or get_grobid_client()
+        # documents are read from disk only while they hold a GROBID slot
+        self._parse_semaphore = asyncio.Semaphore(self.grobid_client.max_concurrency)
+        self._chunk_semaphore = asyncio.Semaphore(chunk_concurrency or get_setting("INGEST_CHUNK_CONCURRENCY", 2, int))
+        self._embed_semaphore = asyncio.Semaphore(embed_concurrency or get_setting("INGEST_EMBED_CONCURRENCY", 4, int))
+        self._store_semaphore = asyncio.Semaphore(store_concurrency or get_setting("INGEST_STORE_CONCURRENCY", 4, int))
+        self._tasks = set()
+
+    def start(self, job:Job, files:list, chunk_size:int, chunk_overlap:int, splitter_type:str, vectorizer:str, key:str|None = None):
+        """
+        Starts the ingestion of the files as a background task of the running event loop.
+
+        Args:
+            job (Job): The job reporting the progress, with one item per file.
+            files (list): (title, PDF path) tuples, see spool_upload. The files are deleted once parsed.
+            chunk_size (int): size of the resulting chunks.
+            chunk_overlap (int): the size of the chunk overlap.
+            splitter_type (str): the desired way of splitting the text.
+            vectorizer (str): The intended vectorizer to use.
+            key (str, optional): The OpenAI key.
+
+        Returns:
+            asyncio.Task: The running task.
+        """
+        task = asyncio.create_task(self.run(job, files, chunk_size, chunk_overlap, splitter_type, vectorizer, key))
+        # keep a reference until the task is done, the event loop only holds weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run(self, job:Job, files:list, chunk_size:int, chunk_overlap:int, splitter_type:str, vectorizer:str, key:str|None = None):
+        """
+        Ingests the files and reports the progress of each of them on the job.
+
+        Args:
+            job (Job): The job reporting the progress, with one item per file.
+            files (list): (title, PDF path) tuples, see spool_upload. The files are deleted once parsed.
+            chunk_size (int): size of the resulting chunks.
+            chunk_overlap (int): the size of the chunk overlap.
+            splitter_type (str): the desired way of splitting the text.
+            vectorizer (str): The intended vectorizer to use.
+            key (str, optional): The OpenAI key.
+        """
+        job.start()
+        try:
+            await asyncio.gather(*(
+                self.__ingest(job, index, title, pdf_path, chunk_size, chunk_overlap, splitter_type, vectorizer, key)
+                for index, (title, pdf_path) in enumerate(files)
+            ))
+        except Exception as e:
+            job.fail(e)
+            return
+        job.complete()
+
+    async def __ingest(self, job:Job, index:int, title:str, pdf_path:str, chunk_size:int, chunk_overlap:int,
+                       splitter_type:str, vectorizer:str, key:str|None):
+        """
+        Runs all stages for a single file, failures are recorded on its progress entry.
+        """
+        try:
+            async with self._parse_semaphore:
+                job.update_item(index, stage="parsing")
+                pdf_file = await asyncio.to_thread(self.__read_file, pdf_path)
+                tei = await self.grobid_client.process_fulltext_document(pdf_file)
+            # the PDF is not needed after parsing
+            del pdf_file
+            os.remove(pdf_path)
+
+            job.update_item(index, stage="chunking")
+            async with self._chunk_semaphore:
+                chunks = await asyncio.to_thread(load_and_split_text, tei, chunk_size, chunk_overlap, splitter_type)
+
+            job.update_item(index, stage="embedding", chunks=len(chunks))
+            async with self._embed_semaphore:
+                embeddings = await asyncio.to_thread(embed_docs, chunks, vectorizer, key)
+
+            job.update_item(index, stage="storing")
+            async with self._store_semaphore:
+                result = await asyncio.to_thread(store_docs, chunks, embeddings, vectorizer, title)
+            if result["failed"]:
+                raise RuntimeError(f"{len(result['failed'])} of {len(chunks)} chunks could not be stored.")
+
+            job.update_item(index, stage="done")
+            job.increment("completed")
+        except Exception as e:
+            job.update_item(index, stage="failed", error=str(e))
+            job.increment("failed")
+        finally:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+    @staticmethod
+    def __read_file(path:str):
+        """
+        Reads a spooled PDF file.
+        """
+        with open(path, "rb") as file:
+            return file.read()
+
+def spool_upload(file):
+    """
+    Copies an uploaded file to a temporary file, so it does not stay in memory until it is ingested.
+
+    Args:
+        file (BinaryIO): The uploaded file.
+
+    Returns:
+        str: The path of the temporary file.
+    """
+    descriptor, path = tempfile.mkstemp(suffix=".pdf", prefix="ingest_")
+    with os.fdopen(descriptor, "wb") as spooled:
+        shutil.copyfileobj(file, spooled)
+    return path
+
+__ingestion_pipeline = None
+
+def get_ingestion_pipeline():
+    """
+    Returns the IngestionPipeline shared by the process.
+
+    Returns:
+        IngestionPipeline: The shared pipeline.
+    """
+    global __ingestion_pipeline
+    if __ingestion_pipeline is None:
+        __ingestion_pipeline = IngestionPipeline()
+    return __ingestion_pipeline
@@ -0,0 +1,221 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from service.etc.settings import get_setting
+
+class Job:
+    """
+    A background job with a status, counters and optional per-item progress.
+
+    Jobs are updated from worker threads and event loop tasks, every update is guarded by a lock.
+    """
+
+    def __init__(self, kind:str, items:list|None = None, progress:dict|None = None):
+        """
+        Initializes a Job object.
+
+        Args:
+            kind (str): The kind of work, e.g. "batch_ingestion".
+            items (list, optional): Initial progress entries, one dict per processed item.
+            progress (dict, optional): Initial progress counters.
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "pending"
+        self.progress = progress or {}
+        self.items = items or []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        """
+        Whether the job has completed or failed.
+        """
+        return self.status in ("completed", "failed")
+
+    def start(self):
+        """
+        Marks the job as running.
+        """
+        with self._lock:
+            self.status = "running"
+            self.updated_at = time.time()
+
+    def increment(self, name:str, amount:int = 1):
+        """
+        Increments a progress counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (int, optional): The increment. Defaults to 1.
+        """
+        with self._lock:
+            self.progress[name] = self.progress.get(name, 0) + amount
+            self.updated_at = time.time()
+
+    def update_item(self, index:int, **values):
+        """
+        Updates the progress entry of a single item.
+
+        Args:
+            index (int): The position of the item.
+            **values: The progress values to set.
+        """
+        with self._lock:
+            self.items[index].update(values)
+            self.updated_at = time.time()
+
+    def complete(self, result=None):
+        """
+        Marks the job as completed.
+
+        Args:
+            result (optional): The result of the job.
+        """
+        with self._lock:
+            self.status = "completed"
+            self.result = result
+            self.updated_at = time.time()
+
+    def fail(self, error:Exception|str):
+        """
+        Marks the job as failed.
+
+        Args:
+            error (Exception | str): The reason of the failure.
+        """
+        with self._lock:
+            self.status = "failed"
+            self.error = str(error)
+            self.updated_at = time.time()
+
+    def to_dict(self, include_result:bool = False):
+        """
+        Returns a snapshot of the job, e.g. for a status response.
+
+        Args:
+            include_result (bool, optional): Whether to include the result. Defaults to False.
+
+        Returns:
+            dict: The job state.
+        """
+        with self._lock:
+            state = {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+                "error": self.error,
+            }
+            if self.items:
+                state["items"] = [dict(item) for item in self.items]
+            if include_result:
+                state["result"] = self.result
+            return state
+
+class JobRegistry:
+    """
+    An in-memory registry of the jobs of this process.
+
+    Only the most recent jobs are kept, finished jobs are dropped first.
+    """
+
+    def __init__(self, max_jobs:int = 1000):
+        """
+        Initializes a JobRegistry object.
+
+        Args:
+            max_jobs (int, optional): The number of jobs to keep. Defaults to 1000.
+        """
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, kind:str, items:list|None = None, progress:dict|None = None):
+        """
+        Creates and registers a new job.
+
+        Args:
+            kind (str): The kind of work.
+            items (list, optional): Initial progress entries of the processed items.
+            progress (dict, optional): Initial progress counters.
+
+        Returns:
+            Job: The new job.
+        """
+        job = Job(kind, items, progress)
+        with self._lock:
+            self._jobs[job.id] = job
+            if len(self._jobs) > self.max_jobs:
+                finished = [job_id for job_id, old_job in self._jobs.items() if old_job.finished]
+                for job_id in finished[:len(self._jobs) - self.max_jobs]:
+                    del self._jobs[job_id]
+        return job
+
+    def get(self, job_id:str):
+        """
+        Returns a registered job.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            Job: The job or None if it is unknown.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+__job_registry = None
+__job_registry_lock = threading.Lock()
+
+def get_job_registry():
+    """
+    Returns the JobRegistry shared by the process.
+
+    Returns:
+        JobRegistry: The shared registry.
+    """
+    global __job_registry
+    with __job_registry_lock:
+        if __job_registry is None:
+            __job_registry = JobRegistry()
+        return __job_registry
+
+__job_executor = None
+
+def run_in_background(job:Job, function, *args, **kwargs):
+    """
+    Runs a function for a job on the shared worker pool (JOB_WORKERS threads, defaults to 4).
+    The return value becomes the result of the job, an exception marks it as failed.
+
+    Args:
+        job (Job): The job to run.
+        function (callable): The work to do.
+        *args: Positional arguments of the function.
+        **kwargs: Keyword arguments of the function.
+
+    Returns:
+        concurrent.futures.Future: The future of the work.
+    """
+    global __job_executor
+    with __job_registry_lock:
+        if __job_executor is None:
+            __job_executor = ThreadPoolExecutor(max_workers=get_setting("JOB_WORKERS", 4, int), thread_name_prefix="job")
+        executor = __job_executor
+
+    def run():
+        job.start()
+        try:
+            job.complete(function(*args, **kwargs))
+        except Exception as e:
+            job.fail(e)
+
+    return executor.submit(run)
@@ -1,7 +1,25 @@
 import re
-import eurlex
-from bs4 import BeautifulSoup as bs
-from service.weaviate_connection import WeaviateConnection
+import threading
+from lxml import etree
+from service.etc.settings import get_setting
+from service.eurlex_fetcher import get_eurlex_fetcher
+from service.ttl_cache import TTLCache
+from service.weaviate_connection import get_weaviate_connection
+
+# placeholder description of regulations without a usable abstract
+DEFAULT_ABSTRACT = "A policy"
+
+# characters of the HTML document fed to the pull parser at once
+HTML_FEED_SIZE = 64 * 1024
+
+# paragraphs ending the enacting terms of a single-article regulation
+CLOSING_FORMULAS = ("this regulation shall be binding", "done at")
+
+# class suffixes of article title paragraphs
+ARTICLE_TITLE_CLASSES = ("sti-art", "stitle-article-norm")
+
+# slash notation of a regulation (e.g., 12/2022) that is not part of a longer number
+SLASH_NOTATION_PATTERN = re.compile(r"(?<!\d)\d{1,3}/\d{4}(?!\d)")
 
 
 def inject_knowledge(chunk):
@@ -15,71 +33,146 @@ def inject_knowledge(chunk):
         str: The modified chunk with knowledge tags.
 
     """
-    matches = __extract_slash_notation(chunk)
-    knowledge_dict = __create_knowledge_dict(matches)
-    for slash_notation, content in knowledge_dict.items():
-        chunk = chunk.replace(slash_notation, f"<reg>{slash_notation}</reg><reg_desc>{content}</reg_desc>")
-    return chunk
+    return inject_knowledge_spans(chunk)[0]
+
+def inject_knowledge_spans(chunk):
+    """
+    Injects knowledge into the given chunk and returns the slash notations it found.
+
+    Args:
+        chunk (str): The chunk of text to inject knowledge into.
+
+    Returns:
+        tuple: The modified chunk with knowledge tags and the (start, end, slash notation)
+        span of every slash notation in the original chunk.
+    """
+    spans = find_slash_notations(chunk)
+    knowledge_dict = __create_knowledge_dict([span[2] for span in spans])
+    return __annotate_chunk(chunk, spans, knowledge_dict), spans
 
-def __extract_slash_notation(text):
+def inject_knowledge_document(chunks):
     """
-    Extracts slash notation (e.g., 12/2022) from the given text.
+    Injects knowledge into all chunks of a document.
+
+    The slash notations of all chunks are resolved together, so every referenced
+    regulation is looked up once per document instead of once per chunk.
+
+    Args:
+        chunks (list): The chunks of the document.
+
+    Returns:
+        list: The modified chunks with knowledge tags, in the same order.
+    """
+    spans = [find_slash_notations(chunk) for chunk in chunks]
+    knowledge_dict = __create_knowledge_dict([span[2] for chunk_spans in spans for span in chunk_spans])
+    return [__annotate_chunk(chunk, chunk_spans, knowledge_dict) for chunk, chunk_spans in zip(chunks, spans)]
+
+def find_slash_notations(text):
+    """
+    Finds the slash notations (e.g., 12/2022) in the given text. Numbers that merely contain
+    a notation, like 1/2009 in 631/2009 or 12/20221, are not matched.
 
     Args:
         text (str): The text to search for slash notation.
 
     Returns:
-        list: A list of slash notation found in the text.
+        list: The (start, end, slash notation) span of every slash notation, in order.
+    """
+    return [(match.start(), match.end(), match.group()) for match in SLASH_NOTATION_PATTERN.finditer(text)]
+
+def __annotate_chunk(chunk, spans, knowledge_dict):
+    """
+    Wraps the given slash notation spans of a chunk in knowledge tags in a single pass.
+
+    Args:
+        chunk (str): The chunk of text to inject knowledge into.
+        spans (list): The (start, end, slash notation) spans found in the chunk.
+        knowledge_dict (dict): The content of each slash notation.
+
+    Returns:
+        str: The modified chunk with knowledge tags.
     """
-    pattern = r'\d{1,3}\/\d{4}'
-    matches = re.findall(pattern, text)
-    return matches
+    parts = []
+    position = 0
+    for start, end, slash_notation in spans:
+        parts.append(chunk[position:start])
+        parts.append(f"<reg>{slash_notation}</reg><reg_desc>{knowledge_dict[slash_notation]}</reg_desc>")
+        position = end
+    parts.append(chunk[position:])
+    return "".join(parts)
 
 def __get_abstract(html):
     """
-    Extracts the abstract from an HTML document.
+    Extracts the abstract, the body of the first article, from an HTML document.
+
+    The document is streamed through the lxml pull parser, parsing stops at the heading of
+    the second article. Headings are matched regardless of case and non-breaking spaces,
+    article titles are skipped and single-article regulations ("Sole Article") end at the
+    closing formula.
 
     Args:
         html (str): The HTML document.
 
     Returns:
         str: The extracted abstract.
-
-    Raises:
-        Exception: If an error occurs during the extraction process.
     """
-
     try:
-        soup = bs(html, features="html.parser")
-        p_tags_text = []
-        p_tags = soup.find_all("p")
-        start = False
-        end = False
-
-        for p_tag in p_tags:
-            if p_tag.text == "Article 1" or p_tag.text == "Article 1":
-                start = True
-            if p_tag.text == "Article 2" or p_tag.text == "Article 2":
-                start = False
-                end = True
-            if start:
-                p_tags_text.append(p_tag.text)
-            if end:
-                break
-
-        abstract = ' '.join(p_tags_text[2:])
-        if abstract == "":
-            abstract = "A policy"
+        parser = etree.HTMLPullParser(events=("end",), tag="p")
+        paragraphs = []
+        heading = None
+        first_paragraph = False
+        for i in range(0, len(html), HTML_FEED_SIZE):
+            parser.feed(html[i:i + HTML_FEED_SIZE])
+            for _, p_tag in parser.read_events():
+                text = " ".join("".join(p_tag.itertext()).split())
+                is_title = __is_article_title(p_tag)
+                p_tag.clear()
+                normalized = text.casefold()
+                if heading is None:
+                    if normalized in ("article 1", "sole article"):
+                        heading = normalized
+                        first_paragraph = True
+                    continue
+                if normalized == "article 2" or (heading == "sole article" and normalized.startswith(CLOSING_FORMULAS)):
+                    return " ".join(paragraphs) or DEFAULT_ABSTRACT
+                if first_paragraph and text:
+                    first_paragraph = False
+                    if is_title:
+                        continue
+                if text:
+                    paragraphs.append(text)
+        parser.close()
+        abstract = " ".join(paragraphs)
     except Exception as e:
-        abstract = "A policy"
-    
-    return abstract
+        abstract = ""
+    return abstract or DEFAULT_ABSTRACT
 
+def __is_article_title(p_tag):
+    """
+    Checks if a paragraph is the title of an article in one of the EUR-Lex formats: sti-art in
+    older documents, oj-sti-art in the Official Journal and stitle-article-norm in consolidated
+    texts, the latter two also wrapped in an eli-title division.
+
+    Args:
+        p_tag (lxml.etree._Element): The paragraph.
+
+    Returns:
+        bool: True if the paragraph is an article title.
+    """
+    if any(css_class.endswith(ARTICLE_TITLE_CLASSES) for css_class in p_tag.get("class", "").split()):
+        return True
+    parent = p_tag.getparent()
+    return parent is not None and "eli-title" in parent.get("class", "").split()
 
 def __create_knowledge_dict(slash_notations):
     """
     Creates a dictionary of knowledge by retrieving content from EurLex API.
 
+    Notations are first looked up in the in-process knowledge cache, then in Weaviate and
+    finally on EurLex, whose misses are fetched concurrently. Notations without a usable abstract are cached as negative entries
+    and described with the placeholder abstract. Placeholders stored in Weaviate by earlier versions count as
+    missing and are replaced once EurLex returns an abstract.
+
     Args:
         slash_notations (list): A list of slash notations.
 
@@ -87,16 +180,69 @@ def __create_knowledge_dict(slash_notations):
         dict: A dictionary where the keys are slash notations and the values are the corresponding content.
 
     """
+    cache = get_knowledge_cache()
     knowledge_dict = {}
-    weaviate = WeaviateConnection()
-    for slash_notation in slash_notations:
-        knowledge = weaviate.get_knowledge(slash_notation)
-        if knowledge is not None:
+    unresolved = []
+    for slash_notation in dict.fromkeys(slash_notations):
+        hit, knowledge = cache.get(slash_notation)
+        if not hit:
+            unresolved.append(slash_notation)
+        else:
+            knowledge_dict[slash_notation] = knowledge if knowledge is not None else DEFAULT_ABSTRACT
+    if not unresolved:
+        return knowledge_dict
+
+    weaviate = get_weaviate_connection()
+    # resolve all stored notations with one query
+    lookup = weaviate.get_knowledge_bulk(unresolved)
+    stored_placeholders = set()
+    for slash_notation, knowledge in lookup["found"].items():
+        if knowledge == DEFAULT_ABSTRACT:
+            stored_placeholders.add(slash_notation)
+        else:
             knowledge_dict[slash_notation] = knowledge
-            continue
-        celex = eurlex.get_celex_id(slash_notation=slash_notation)
-        html = eurlex.get_html_by_celex_id(celex)
-        content = __get_abstract(html)
+            cache.put(slash_notation, knowledge)
+    missing = [slash_notation for slash_notation in unresolved if slash_notation not in knowledge_dict]
+
+    # fetch all remaining notations concurrently, each request has its own timeout
+    pages = get_eurlex_fetcher().fetch_many(missing)
+    for slash_notation in missing:
+        html = pages[slash_notation]
+        if isinstance(html, Exception):
+            print(f"Error retrieving {slash_notation} from EurLex: {html}")
+            content = DEFAULT_ABSTRACT
+        else:
+            content = __get_abstract(html)
         knowledge_dict[slash_notation] = content
-        weaviate.store_knowledge(slash_notation, content)
-    return knowledge_dict
\ No newline at end of file
+        if content == DEFAULT_ABSTRACT:
+            # retried once the negative entry expires, so it is not stored in the database
+            cache.put_negative(slash_notation)
+        else:
+            cache.put(slash_notation, content)
+            if slash_notation in stored_placeholders:
+                weaviate.replace_knowledge(slash_notation, content)
+            else:
+                weaviate.store_knowledge(slash_notation, content)
+    return knowledge_dict
+
+__knowledge_cache = None
+__knowledge_cache_lock = threading.Lock()
+
+def get_knowledge_cache():
+    """
+    Returns the in-process cache of regulation abstracts. Its size and time to live are read
+    from KNOWLEDGE_CACHE_SIZE (10000 entries), KNOWLEDGE_CACHE_TTL (1 day) and
+    KNOWLEDGE_CACHE_NEGATIVE_TTL (1 hour).
+
+    Returns:
+        TTLCache: The shared cache.
+    """
+    global __knowledge_cache
+    with __knowledge_cache_lock:
+        if __knowledge_cache is None:
+            __knowledge_cache = TTLCache(
+                max_size=get_setting("KNOWLEDGE_CACHE_SIZE", 10000, int),
+                ttl=get_setting("KNOWLEDGE_CACHE_TTL", 86400.0, float),
+                negative_ttl=get_setting("KNOWLEDGE_CACHE_NEGATIVE_TTL", 3600.0, float),
+            )
+        return __knowledge_cache
@@ -1,13 +1,25 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 from enum import Enum
+from functools import lru_cache
 from dotenv import load_dotenv, find_dotenv
 import requests
 import os
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
 from langchain_community.llms import Ollama
 import json
+import threading
+from service.chain_registry import ChainRegistry
 from service.etc.output_classes import Questions, ChunkSummary, PolicySummary, Answer
+from service.etc.settings import get_setting
+from service.llm_cache import get_llm_cache
+from service.splitter import embed_query
+from service.weaviate_connection import get_weaviate_connection
 
 
 class LanguageModel(Enum):
@@ -20,19 +32,87 @@ class KnowledgeLevel(Enum):
     BASICS = "A basic understanding"
     EXPERT = "An expert understanding"
 
+@lru_cache(maxsize=None)
+def get_tokenizer(model:LanguageModel):
+    """
+    Returns a token counter for the language model, created once per model.
+
+    OpenAI models use their tiktoken encoding, other models the cl100k_base encoding as an
+    approximation. If tiktoken or its encoding files are unavailable, tokens are estimated
+    as four characters each.
+
+    Args:
+        model (LanguageModel): The language model.
+
+    Returns:
+        Callable[[str], int]: Counts the tokens of a text.
+    """
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model.value)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails without network access
+        print(f"Falling back to estimated token counts for {model.value}: {e}")
+        return lambda text: (len(text) + 3) // 4
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+# prompts.json next to this module, independent of the working directory
+PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "etc", "prompts.json")
+
+# template and output class of every chain
+CHAIN_TEMPLATES = {
+    "questionnaire": ("The part of the document is {chunk}.\n{format_instructions}\n{query}\n", Questions),
+    "chunk_summary": ("{format_instructions}\n {query}\n The Chunk: {text_chunk}\n", ChunkSummary),
+    "full_summary": ("{format_instructions}\n {query}\n {knowledge_prompt}\n The Chunk summary: {chunk_summary}\n The partial summary: {partial_summary}\n", PolicySummary),
+    "compact_summary": ("{format_instructions}\n {query}\n {knowledge_prompt}\n The summary should have at most {target_words} words.\n The partial summary: {partial_summary}\n", PolicySummary),
+    "combine_summary": ("{format_instructions}\n {query}\n {knowledge_prompt}\n The summaries:\n{summaries}\n", PolicySummary),
+    "query": ("{format_instructions}\n {query}\n Question: {question}\n Context: {text_chunk}\n", Answer),
+}
+
+@lru_cache(maxsize=None)
+def load_prompts():
+    """
+    Loads the prompts once per process.
+
+    Returns:
+        dict: The prompt of every task.
+    """
+    with open(PROMPTS_PATH, 'r') as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def get_format_instructions(output_class):
+    """
+    Returns the format instructions of an output class, generated once per class.
+
+    Args:
+        output_class (type): The pydantic class of the response.
+
+    Returns:
+        str: The format instructions.
+    """
+    return JsonOutputParser(pydantic_object=output_class).get_format_instructions()
+
 class LanguageModelConnection:
-    def __init__(self, model:LanguageModel, key:str|None = None):
+    def __init__(self, model:LanguageModel, key:str|None = None, bypass_cache:bool = False):
         self.model = model
         self.key = key
-         # Load prompts from external JSON file
-        with open('service/etc/prompts.json', 'r') as f:
-            self.prompts = json.load(f)
+        # skip the persistent response cache, e.g. to sample fresh responses
+        self.bypass_cache = bypass_cache
+        # Load prompts from external JSON file
+        self.prompts = load_prompts()
+        # chains are built once per connection and shared between requests
+        self.chains = ChainRegistry()
 
         if model == LanguageModel.LLAMA2:
                 load_dotenv(find_dotenv())
                 self.ol_url = os.environ.get("OLLAMA_URL")
                 self.model_url = self.ol_url+'/api/generate'
-                self.llm = Ollama(model=LanguageModel.LLAMA2, base_url=self.ol_url, max_tokens=-1, temperature=0.2)
+                # num_predict=-1 lets the model generate until it stops by itself
+                self.llm = Ollama(model=LanguageModel.LLAMA2.value, base_url=self.ol_url, num_predict=-1, temperature=0.2)
         elif model == LanguageModel.GPT_3_5:
                 self.model_url = 'https://api.openai.com/v1/engines/gpt-3.5-turbo/completions'
                 self.llm = ChatOpenAI(openai_api_key=self.key, temperature=0.2)
@@ -44,39 +124,255 @@ class LanguageModelConnection:
         # A query intented to prompt a language model to populate the data structure.
         question_query = self.prompts['questionnaire']
 
-        # Set up a parser + inject instructions into the prompt template.
-        parser = JsonOutputParser(pydantic_object=Questions)
-
-        prompt = PromptTemplate(
-        template="The part of the document is {chunk}.\n{format_instructions}\n{query}\n",
-        input_variables=["query", "chunk"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
-
-        chain = prompt | self.llm | parser
+        chain = self.__chain("questionnaire")
 
         result = chain.invoke({"query": question_query, "chunk": document_chunk})
         return result
     
     def generate_chunk_summary(self, text_chunk):
-        # A query intented to prompt a language model.
-        sum_query = self.prompts['chunk_summary']
+        chain = self.__chain("chunk_summary")
+
+        result = chain.invoke({"query": self.prompts['chunk_summary'], "text_chunk": text_chunk})
+        return result
+
+    def generate_chunk_summaries(self, text_chunks, max_concurrency:int|None = None, max_retries:int|None = None):
+        """
+        Summarizes all chunks of a document concurrently.
+
+        Args:
+            text_chunks (list): The chunks of the document.
+            max_concurrency (int, optional): LLM calls running at once (LLM_CONCURRENCY). Defaults to 4.
+            max_retries (int, optional): Retries of a failed chunk (LLM_MAX_RETRIES). Defaults to 2.
+
+        Returns:
+            list: The summary of each chunk, in the order of the chunks.
+
+        Raises:
+            Exception: The error of a chunk that still fails after all retries.
+        """
+        settings = self.__batch_settings(max_concurrency, max_retries)
+        return self.__batch(self.__chain("chunk_summary"), self.__chunk_summary_inputs(text_chunks), settings)
+
+    async def agenerate_chunk_summaries(self, text_chunks, max_concurrency:int|None = None, max_retries:int|None = None):
+        """
+        Summarizes all chunks of a document concurrently without blocking the event loop.
+
+        Args:
+            text_chunks (list): The chunks of the document.
+            max_concurrency (int, optional): LLM calls running at once (LLM_CONCURRENCY). Defaults to 4.
+            max_retries (int, optional): Retries of a failed chunk (LLM_MAX_RETRIES). Defaults to 2.
+
+        Returns:
+            list: The summary of each chunk, in the order of the chunks.
+
+        Raises:
+            Exception: The error of a chunk that still fails after all retries.
+        """
+        settings = self.__batch_settings(max_concurrency, max_retries)
+        return await self.__abatch(self.__chain("chunk_summary"), self.__chunk_summary_inputs(text_chunks), settings)
+
+    async def aiter_chunk_summaries(self, text_chunks, max_concurrency:int|None = None, max_retries:int|None = None):
+        """
+        Summarizes all chunks of a document concurrently and yields every summary as soon as it is done.
+
+        Args:
+            text_chunks (list): The chunks of the document.
+            max_concurrency (int, optional): LLM calls running at once (LLM_CONCURRENCY). Defaults to 4.
+            max_retries (int, optional): Retries of a failed chunk (LLM_MAX_RETRIES). Defaults to 2.
+
+        Yields:
+            tuple: The index of the chunk and its summary, in order of completion.
+
+        Raises:
+            Exception: The error of a chunk that still fails after all retries.
+        """
+        settings = self.__batch_settings(max_concurrency, max_retries)
+        chain = self.__chain("chunk_summary")
+        inputs = self.__chunk_summary_inputs(text_chunks)
+        rounds = self.__retry_rounds(len(inputs), settings)
+        delay, pending = next(rounds)
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                results = [None] * len(pending)
+                async for i, result in chain.abatch_as_completed([inputs[index] for index in pending], config=settings["config"], return_exceptions=True):
+                    results[i] = result
+                    if not isinstance(result, Exception):
+                        yield pending[i], result
+                delay, pending = rounds.send(results)
+        except StopIteration:
+            return
+
+    def __with_cache(self, prompt, chain):
+        """
+        Wraps a chain so its responses are served from and stored in the persistent LLM cache.
+        """
+        cache = None if self.bypass_cache else get_llm_cache()
+        if cache is None:
+            return chain
+        template = json.dumps({"template": prompt.template, "partial_variables": prompt.partial_variables}, sort_keys=True, default=str)
+        temperature = getattr(self.llm, "temperature", None)
+
+        def invoke(inputs, config):
+            key = cache.make_key(self.model.value, temperature, template, inputs)
+            result = cache.get(key)
+            if result is None:
+                result = chain.invoke(inputs, config)
+                cache.put(key, result)
+            return result
+
+        async def ainvoke(inputs, config):
+            key = cache.make_key(self.model.value, temperature, template, inputs)
+            result = await asyncio.to_thread(cache.get, key)
+            if result is None:
+                result = await chain.ainvoke(inputs, config)
+                await asyncio.to_thread(cache.put, key, result)
+            return result
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+    def chain_stats(self):
+        """
+        Returns the call counts and latencies of the chains of this connection.
+
+        Returns:
+            dict: The statistics per chain name.
+        """
+        return self.chains.stats()
+
+    def __chain(self, name:str):
+        """
+        Returns the registered chain of the given name.
+        """
+        return self.__chain_entry(name)[1]
+
+    def __chain_entry(self, name:str):
+        """
+        Returns the prompt template and the registered chain of the given name, the response
+        cache wraps the timed chain so the chain statistics only count calls to the model.
+        """
+        return self.chains.get(name, lambda: self.__build_chain(name), self.__with_cache)
+
+    def __build_chain(self, name:str):
+        """
+        Builds the prompt template and the chain of the given name.
+        """
+        template, output_class = CHAIN_TEMPLATES[name]
 
         # Set up a parser + inject instructions into the prompt template.
-        parser = JsonOutputParser(pydantic_object=ChunkSummary)
+        parser = JsonOutputParser(pydantic_object=output_class)
 
-        prompt = PromptTemplate(
-        template="{format_instructions}\n {query}\n The Chunk: {text_chunk}\n",
-        input_variables=["query", "text_chunk"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
+        prompt = PromptTemplate.from_template(
+        template,
+        partial_variables={"format_instructions": get_format_instructions(output_class)},
         )
 
-        chain = prompt | self.llm | parser
+        return prompt, prompt | self.llm | parser
+
+    def __chunk_summary_inputs(self, text_chunks):
+        """
+        Returns the chain inputs summarizing the given chunks.
+        """
+        return [{"query": self.prompts['chunk_summary'], "text_chunk": text_chunk} for text_chunk in text_chunks]
+
+    @staticmethod
+    def __batch_settings(max_concurrency:int|None, max_retries:int|None):
+        """
+        Returns the batch config, the number of retries and the retry backoff, missing values are read from the environment.
+        """
+        max_concurrency = max_concurrency or get_setting("LLM_CONCURRENCY", 4, int)
+        max_retries = max_retries if max_retries is not None else get_setting("LLM_MAX_RETRIES", 2, int)
+        return {
+            "config": {"max_concurrency": max_concurrency},
+            "max_retries": max_retries,
+            "backoff": get_setting("LLM_RETRY_BACKOFF", 1.0, float),
+        }
+
+    @classmethod
+    def __retry_rounds(cls, count:int, settings:dict):
+        """
+        Drives the retries of a batch: yields the delay and the input indices of every round and
+        receives their results, only failed inputs are run again. Returns all results in order.
+        """
+        results = [None] * count
+        pending = list(range(count))
+        for attempt in range(settings["max_retries"] + 1):
+            delay = settings["backoff"] * 2 ** (attempt - 1) if attempt else 0
+            round_results = yield delay, pending
+            for i, result in zip(pending, round_results):
+                results[i] = result
+            pending = [i for i in pending if isinstance(results[i], Exception)]
+            if not pending:
+                break
+        return cls.__raise_failed(results)
+
+    @classmethod
+    def __batch(cls, chain, inputs, settings:dict):
+        """
+        Runs the chain on all inputs concurrently, failed inputs are retried on their own.
+        """
+        rounds = cls.__retry_rounds(len(inputs), settings)
+        delay, pending = next(rounds)
+        try:
+            while True:
+                time.sleep(delay)
+                delay, pending = rounds.send(chain.batch([inputs[i] for i in pending], config=settings["config"], return_exceptions=True))
+        except StopIteration as stop:
+            return stop.value
+
+    @classmethod
+    async def __abatch(cls, chain, inputs, settings:dict):
+        """
+        Runs the chain on all inputs concurrently without blocking the event loop, failed inputs are retried on their own.
+        """
+        rounds = cls.__retry_rounds(len(inputs), settings)
+        delay, pending = next(rounds)
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                delay, pending = rounds.send(await chain.abatch([inputs[i] for i in pending], config=settings["config"], return_exceptions=True))
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    def __raise_failed(results):
+        """
+        Returns the batch results or raises the first error left after the retries.
+        """
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def generate_policy_summary(self, chunk_summarys, knowledge_level, mode:str = "sequential",
+                                fan_in:int|None = None, max_tokens:int|None = None, max_summary_tokens:int|None = None):
+        """
+        Combines the chunk summaries of a document into a summary of the policy.
+
+        In sequential mode every chunk summary is merged into a growing partial summary, one
+        LLM call after another, the partial summary is compacted whenever it grows beyond
+        max_summary_tokens. In reduce mode up to fan_in summaries are combined at once, all
+        groups of a level in parallel, until one summary is left.
+
+        Args:
+            chunk_summarys (list): The chunk summaries in document order.
+            knowledge_level (str): The name of the KnowledgeLevel of the reader.
+            mode (str, optional): "sequential" or "reduce". Defaults to "sequential".
+            fan_in (int, optional): Summaries combined by one call in reduce mode (SUMMARY_FAN_IN). Defaults to 4.
+            max_tokens (int, optional): Prompt tokens of one call in reduce mode (SUMMARY_TOKEN_BUDGET). Defaults to 6000.
+            max_summary_tokens (int, optional): Tokens of the partial summary in sequential mode (SUMMARY_RUNNING_TOKEN_BUDGET). Defaults to 2000.
+
+        Returns:
+            str: The summary of the policy.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        if mode == "reduce":
+            return self.__reduce_summaries(chunk_summarys, knowledge_level, fan_in, max_tokens)
+        if mode != "sequential":
+            raise ValueError(f"Unknown summary mode {mode}, expected sequential or reduce.")
 
-        result = chain.invoke({"query": sum_query, "text_chunk": text_chunk})
-        return result
-    
-    def generate_policy_summary(self, chunk_summarys, knowledge_level):
         partial_summary = ""
         # A query intented to prompt a language model.
         sum_query = self.prompts['full_summary']
@@ -84,38 +380,250 @@ class LanguageModelConnection:
         # use the corresponding knowledge prompt based on the knowledge level
         knowledge_prompt = self.prompts[knowledge_level+'_Knowledge']
 
-        # Set up a parser + inject instructions into the prompt template.
-        parser = JsonOutputParser(pydantic_object=PolicySummary)
-
-        prompt = PromptTemplate(
-        template="{format_instructions}\n {query}\n {knowledge_prompt}\n The Chunk summary: {chunk_summary}\n The partial summary: {partial_summary}\n",
-        input_variables=["query", "chunk_summary", "partial_summary", "knowledge"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
+        chain = self.__chain("full_summary")
 
-        chain = prompt | self.llm | parser
+        max_summary_tokens = max_summary_tokens or get_setting("SUMMARY_RUNNING_TOKEN_BUDGET", 2000, int)
 
         for chunk_summary in chunk_summarys:
             result = chain.invoke({"query": sum_query, "chunk_summary": chunk_summary, "partial_summary": partial_summary, "knowledge_prompt": knowledge_prompt})
             partial_summary += result["summary"]
+            if self.count_tokens(partial_summary) > max_summary_tokens:
+                # keep the prompt of the next call from growing with the document
+                partial_summary = self.__compact_summary(partial_summary, knowledge_prompt, max_summary_tokens // 2)
         return partial_summary
-    
-    def query_policy(self, question, document_title):
-        # TODO: Use weaviate to find most similar chunks 
-        most_similar = ""
+
+    def __compact_summary(self, summary:str, knowledge_prompt:str, target_tokens:int):
+        """
+        Condenses a partial summary to about the target number of tokens.
+        """
+        chain = self.__chain("compact_summary")
+
+        # a token is about three quarters of an english word
+        result = chain.invoke({"query": self.prompts['compact_summary'], "knowledge_prompt": knowledge_prompt,
+                               "target_words": target_tokens * 3 // 4, "partial_summary": summary})
+        return result["summary"]
+
+    async def agenerate_policy_summary(self, chunk_summarys, knowledge_level, fan_in:int|None = None, max_tokens:int|None = None):
+        """
+        Combines the chunk summaries of a document in reduce mode without blocking the event loop.
+
+        Args:
+            chunk_summarys (list): The chunk summaries in document order.
+            knowledge_level (str): The name of the KnowledgeLevel of the reader.
+            fan_in (int, optional): Summaries combined by one call (SUMMARY_FAN_IN). Defaults to 4.
+            max_tokens (int, optional): Prompt tokens of one call (SUMMARY_TOKEN_BUDGET). Defaults to 6000.
+
+        Returns:
+            str: The summary of the policy.
+        """
+        levels = self.__reduce_levels(chunk_summarys, knowledge_level, fan_in, max_tokens)
+        settings = self.__batch_settings(None, None)
+        try:
+            chain, inputs = next(levels)
+            while True:
+                chain, inputs = levels.send(await self.__abatch(chain, inputs, settings))
+        except StopIteration as stop:
+            return stop.value
+
+    def count_tokens(self, text:str):
+        """
+        Counts the tokens of a text with the cached tokenizer of the language model.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return get_tokenizer(self.model)(text)
+
+    def __reduce_summaries(self, chunk_summarys, knowledge_level, fan_in:int|None, max_tokens:int|None):
+        """
+        Combines the chunk summaries level by level, the groups of a level are combined in parallel.
+        """
+        levels = self.__reduce_levels(chunk_summarys, knowledge_level, fan_in, max_tokens)
+        settings = self.__batch_settings(None, None)
+        try:
+            chain, inputs = next(levels)
+            while True:
+                chain, inputs = levels.send(self.__batch(chain, inputs, settings))
+        except StopIteration as stop:
+            return stop.value
+
+    def __reduce_levels(self, chunk_summarys, knowledge_level, fan_in:int|None, max_tokens:int|None):
+        """
+        Runs the reduction level by level. Yields the chain and the inputs of every batch of
+        LLM calls, receives their results and returns the summary of the policy.
+
+        Raises:
+            ValueError: If max_tokens leaves no room for summaries in the prompt.
+        """
+        fan_in = max(2, fan_in or get_setting("SUMMARY_FAN_IN", 4, int))
+        max_tokens = max_tokens or get_setting("SUMMARY_TOKEN_BUDGET", 6000, int)
+        knowledge_prompt = self.prompts[knowledge_level+'_Knowledge']
+
+        combine_prompt, combine_chain = self.__chain_entry("combine_summary")
+        base = {"query": self.prompts['combine_summary'], "knowledge_prompt": knowledge_prompt}
+        budget = max_tokens - self.count_tokens(combine_prompt.format(summaries="", **base))
+        # every summary is kept within half of the budget, so any two of them fit into one call
+        limit = budget // 2 - self.count_tokens("\n\n")
+
+        compact_prompt, compact_chain = self.__chain_entry("compact_summary")
+        # a token is about three quarters of an english word
+        compact_base = {"query": self.prompts['compact_summary'], "knowledge_prompt": knowledge_prompt, "target_words": limit * 3 // 4}
+        compact_budget = max_tokens - self.count_tokens(compact_prompt.format(partial_summary="", **compact_base))
+        if limit < 1 or compact_budget < 1:
+            raise ValueError(f"A budget of {max_tokens} tokens leaves no room for summaries in the prompt.")
+
+        summaries = [str(chunk_summary) for chunk_summary in chunk_summarys]
+        while summaries:
+            oversized = [i for i, summary in enumerate(summaries) if self.count_tokens(summary) > limit]
+            if oversized:
+                # compact what is too long to be paired, and cut what the model leaves too long
+                results = yield compact_chain, [{**compact_base, "partial_summary": self.__truncate(summaries[i], compact_budget)} for i in oversized]
+                for i, result in zip(oversized, results):
+                    summaries[i] = self.__truncate(result["summary"], limit)
+
+            groups = self.__group_summaries(summaries, fan_in, budget)
+            # single summaries move up a level unchanged, only the last one is rewritten for the reader
+            calls = [i for i, group in enumerate(groups) if len(group) > 1 or len(groups) == 1]
+            results = yield combine_chain, [{**base, "summaries": "\n\n".join(groups[i])} for i in calls]
+            summaries = self.__next_level(groups, calls, results)
+            if len(groups) == 1:
+                return summaries[0]
+        return ""
+
+    def __truncate(self, text:str, max_tokens:int):
+        """
+        Cuts a text down to at most max_tokens tokens.
+        """
+        tokens = self.count_tokens(text)
+        while tokens > max_tokens:
+            text = text[:max(0, len(text) * max_tokens // tokens - 1)]
+            tokens = self.count_tokens(text)
+        return text
+
+    def __group_summaries(self, summaries, fan_in:int, budget:int):
+        """
+        Packs consecutive summaries into groups of at most fan_in summaries within the token budget.
+        """
+        separator_tokens = self.count_tokens("\n\n")
+        groups = []
+        group = []
+        tokens = 0
+        for summary in summaries:
+            summary_tokens = self.count_tokens(summary) + separator_tokens
+            if group and (len(group) == fan_in or tokens + summary_tokens > budget):
+                groups.append(group)
+                group = []
+                tokens = 0
+            group.append(summary)
+            tokens += summary_tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    @staticmethod
+    def __next_level(groups, calls, results):
+        """
+        Returns the summaries of the next level, the combined groups and the single summaries in order.
+        """
+        summaries = [group[0] for group in groups]
+        for i, result in zip(calls, results):
+            summaries[i] = result["summary"]
+        return summaries
+
+    def query_policy(self, question, document_title, vectorizer:str|None = None, top_k:int|None = None,
+                     max_context_tokens:int|None = None):
+        """
+        Answers a question about a policy document using its most similar chunks as context.
+
+        Args:
+            question (str): The question.
+            document_title (str): The title the chunks of the document were stored with.
+            vectorizer (str, optional): The vectorizer the chunks were embedded with (QUERY_VECTORIZER). Defaults to nomic-embed-text.
+            top_k (int, optional): Maximum number of retrieved chunks (QUERY_TOP_K). Defaults to 5.
+            max_context_tokens (int, optional): Tokens of the retrieved context (QUERY_CONTEXT_TOKEN_BUDGET). Defaults to 3000.
+
+        Returns:
+            dict: The answer.
+        """
+        most_similar = self.__retrieve_context(question, document_title, vectorizer, top_k, max_context_tokens)
         # A query intented to prompt a language model.
         query = self.prompts['query']
 
-        # Set up a parser + inject instructions into the prompt template.
-        parser = JsonOutputParser(pydantic_object=Answer)
+        chain = self.__chain("query")
 
-        prompt = PromptTemplate(
-        template="{format_instructions}\n {query}\n Context: {text_chunk}\n",
-        input_variables=["query", "text_chunk"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
+        result = chain.invoke({"query": query, "question": question, "text_chunk": most_similar})
+        return result
+
+    def __retrieve_context(self, question, document_title, vectorizer:str|None, top_k:int|None, max_context_tokens:int|None):
+        """
+        Returns the chunks closest to the question that fit into the token budget, in document order.
+        """
+        vectorizer = vectorizer or get_setting("QUERY_VECTORIZER", "nomic-embed-text")
+        top_k = top_k or get_setting("QUERY_TOP_K", 5, int)
+        max_context_tokens = max_context_tokens or get_setting("QUERY_CONTEXT_TOKEN_BUDGET", 3000, int)
+
+        vector = embed_query(question, vectorizer, self.key)
+        matches = get_weaviate_connection().search_chunks(vector, vectorizer, document_title, top_k)
+
+        selected = []
+        tokens = 0
+        for match in matches:
+            chunk_tokens = self.count_tokens(match["chunk"])
+            if tokens + chunk_tokens > max_context_tokens:
+                continue
+            selected.append(match)
+            tokens += chunk_tokens
+        return "\n\n".join(match["chunk"] for match in sorted(selected, key=lambda match: match["position"]))
+
+__connections = OrderedDict()
+__connections_lock = threading.Lock()
+
+def get_language_model_connection(model:LanguageModel, key:str|None = None):
+    """
+    Returns the LanguageModelConnection shared by the process for a model and key, so its
+    chains are built once and reused by all requests. The least recently used connections
+    are dropped beyond LLM_CONNECTION_CACHE_SIZE (default 16). The cache is indexed by a hash
+    of the key, the connections themselves hold the key for their requests while cached.
+
+    Args:
+        model (LanguageModel): The language model.
+        key (str, optional): The OpenAI key.
+
+    Returns:
+        LanguageModelConnection: The shared connection.
+    """
+    cache_key = (model, key and hashlib.sha256(key.encode("utf-8")).hexdigest())
+    with __connections_lock:
+        connection = __connections.get(cache_key)
+        if connection is None:
+            connection = LanguageModelConnection(model, key)
+            __connections[cache_key] = connection
+            while len(__connections) > max(1, get_setting("LLM_CONNECTION_CACHE_SIZE", 16, int)):
+                __connections.popitem(last=False)
+        __connections.move_to_end(cache_key)
+        return connection
 
-        chain = prompt | self.llm | parser
+def get_chain_stats():
+    """
+    Returns the chain statistics of all shared connections.
 
-        result = chain.invoke({"query": query, "text_chunk": most_similar})
-        return result
\ No newline at end of file
+    Returns:
+        dict: The statistics per chain name of every model.
+    """
+    with __connections_lock:
+        connections = list(__connections.values())
+    stats = {}
+    for connection in connections:
+        for name, chain_stats in connection.chain_stats().items():
+            merged = stats.setdefault(connection.model.value, {}).setdefault(name, {"calls": 0, "failures": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            merged["calls"] += chain_stats["calls"]
+            merged["failures"] += chain_stats["failures"]
+            merged["total_seconds"] += chain_stats["total_seconds"]
+            merged["max_seconds"] = max(merged["max_seconds"], chain_stats["max_seconds"])
+    for model_stats in stats.values():
+        for merged in model_stats.values():
+            merged["mean_seconds"] = merged["total_seconds"] / merged["calls"] if merged["calls"] else 0.0
+    return stats
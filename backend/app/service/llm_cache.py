@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from service.etc.settings import get_setting
+from service.persistent_cache import PersistentCache
+
+class LLMCache:
+    """
+    A persistent cache of parsed language model responses.
+
+    Responses are keyed by model, temperature, prompt template and a SHA-256 of the inputs
+    and stored as JSON in a local SQLite file, so rerunning a document repeats no identical call.
+    """
+
+    def __init__(self, path:str|None = None, max_bytes:int|None = None):
+        """
+        Initializes an LLMCache object. Missing arguments are read from the environment.
+
+        Args:
+            path (str, optional): The SQLite file (LLM_CACHE_PATH). Defaults to llm_cache.sqlite in the temp directory.
+            max_bytes (int, optional): Maximum size of the stored responses (LLM_CACHE_MAX_BYTES). Defaults to 256 MiB.
+        """
+        path = path or get_setting("LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "llm_cache.sqlite"))
+        max_bytes = max_bytes if max_bytes is not None else get_setting("LLM_CACHE_MAX_BYTES", 256 * 1024 ** 2, int)
+        self.cache = PersistentCache(path, max_bytes)
+
+    @staticmethod
+    def make_key(model:str, temperature:float|None, template:str, inputs:dict):
+        """
+        Computes the cache key of a call.
+
+        Args:
+            model (str): The language model.
+            temperature (float): The sampling temperature.
+            template (str): The prompt template, including its fixed parts.
+            inputs (dict): The inputs of the prompt.
+
+        Returns:
+            str: The cache key.
+        """
+        template_hash = hashlib.sha256(template.encode("utf-8")).hexdigest()
+        inputs_hash = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return f"{model}:{temperature}:{template_hash}:{inputs_hash}"
+
+    def get(self, key:str):
+        """
+        Returns a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            The parsed response or None if it is not cached.
+        """
+        value = self.cache.get(key)
+        return None if value is None else json.loads(value)
+
+    def put(self, key:str, response):
+        """
+        Stores a response.
+
+        Args:
+            key (str): The cache key.
+            response: The parsed response, must be JSON serializable.
+        """
+        self.cache.put(key, json.dumps(response).encode("utf-8"))
+
+    def stats(self):
+        """
+        Returns the hit and miss counts and the size of the cache.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        return self.cache.stats()
+
+__llm_cache = None
+__llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """
+    Returns the LLMCache shared by the process, or None if caching is disabled (LLM_CACHE=0).
+
+    Returns:
+        LLMCache: The shared cache.
+    """
+    global __llm_cache
+    with __llm_cache_lock:
+        if __llm_cache is None and get_setting("LLM_CACHE", 1, int):
+            __llm_cache = LLMCache()
+        return __llm_cache
@@ -0,0 +1,130 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from service.etc.settings import get_setting
+
+class OllamaConnection:
+    """
+    A class representing a pooled connection to the Ollama embedding API.
+
+    Chunks are sent in batches to the batched /api/embed endpoint, several batches are in
+    flight at once and transient failures are retried with backoff.
+    """
+
+    def __init__(self, ollama_url:str|None = None, batch_size:int|None = None, max_concurrency:int|None = None,
+                 max_retries:int|None = None, timeout:float|None = None):
+        """
+        Initializes an OllamaConnection object. Missing arguments are read from the environment.
+
+        Args:
+            ollama_url (str, optional): The Ollama base URL (OLLAMA_URL).
+            batch_size (int, optional): Chunks per request (OLLAMA_EMBED_BATCH_SIZE). Defaults to 32.
+            max_concurrency (int, optional): Batches in flight at once (OLLAMA_EMBED_CONCURRENCY). Defaults to 4.
+            max_retries (int, optional): Retries on connection errors and 429/5xx responses (OLLAMA_MAX_RETRIES). Defaults to 3.
+            timeout (float, optional): Seconds to wait for a batch (OLLAMA_TIMEOUT). Defaults to 120.
+
+        Raises:
+            ValueError: If the Ollama URL is missing.
+        """
+        self.ollama_url = ollama_url or get_setting("OLLAMA_URL")
+        if not self.ollama_url:
+            raise ValueError("Ollama URL is missing, please specify in .env file.")
+        self.batch_size = batch_size or get_setting("OLLAMA_EMBED_BATCH_SIZE", 32, int)
+        self.max_concurrency = max_concurrency or get_setting("OLLAMA_EMBED_CONCURRENCY", 4, int)
+        self.max_retries = max_retries if max_retries is not None else get_setting("OLLAMA_MAX_RETRIES", 3, int)
+        self.timeout = timeout if timeout is not None else get_setting("OLLAMA_TIMEOUT", 120.0, float)
+
+        retry = Retry(total=self.max_retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="ollama")
+        # single queries must answer quickly, they are not retried
+        self.query_session = requests.Session()
+        query_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+        self.query_session.mount("http://", query_adapter)
+        self.query_session.mount("https://", query_adapter)
+
+    def embed(self, docs:list, model:str, progress=None):
+        """
+        Embeds the chunks with the given model, keeping their order.
+
+        Args:
+            docs (list): The chunks to embed.
+            model (str): The Ollama embedding model, e.g. "mxbai-embed-large".
+            progress (callable, optional): Called as progress("embedded", count) after each batch.
+
+        Raises:
+            requests.HTTPError: If a batch still fails after all retries.
+
+        Returns:
+            np.ndarray: A float32 matrix with one embedding per row.
+        """
+        batches = [docs[i:i + self.batch_size] for i in range(0, len(docs), self.batch_size)]
+
+        def embed_batch(batch):
+            embeddings = self.__embed_batch(batch, model)
+            if progress is not None:
+                progress("embedded", len(batch))
+            return embeddings
+
+        batch_embeddings = list(self._executor.map(embed_batch, batches))
+        if not batch_embeddings:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(batch_embeddings)
+
+    def embed_query(self, query:str, model:str, timeout:float):
+        """
+        Embeds a single query with one request, without retries.
+
+        Args:
+            query (str): The query.
+            model (str): The Ollama embedding model, e.g. "mxbai-embed-large".
+            timeout (float): Seconds to wait for the embedding.
+
+        Raises:
+            requests.RequestException: If the request fails or times out.
+
+        Returns:
+            np.ndarray: The float32 embedding of the query.
+        """
+        response = self.query_session.post(f"{self.ollama_url}/api/embed", json={"model": model, "input": [query]}, timeout=timeout)
+        response.raise_for_status()
+        return np.asarray(response.json()["embeddings"][0], dtype=np.float32)
+
+    def __embed_batch(self, batch:list, model:str):
+        """
+        Sends one batch to the embed endpoint.
+
+        Returns:
+            np.ndarray: The float32 embeddings of the batch.
+        """
+        body = {"model": model, "input": batch}
+        response = self.session.post(f"{self.ollama_url}/api/embed", json=body, timeout=self.timeout)
+        response.raise_for_status()
+        # convert right away, so the Python floats of the response are freed with it
+        embeddings = np.asarray(response.json()["embeddings"], dtype=np.float32)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"Ollama returned {len(embeddings)} embeddings for {len(batch)} chunks.")
+        return embeddings
+
+__ollama_connection = None
+__ollama_connection_lock = threading.Lock()
+
+def get_ollama_connection():
+    """
+    Returns the OllamaConnection shared by the process.
+
+    Returns:
+        OllamaConnection: The shared connection.
+    """
+    global __ollama_connection
+    with __ollama_connection_lock:
+        if __ollama_connection is None:
+            __ollama_connection = OllamaConnection()
+        return __ollama_connection
@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import threading
+import time
+
+class PersistentCache:
+    """
+    A persistent key-value cache for binary values stored in a local SQLite file.
+
+    The total size of the values is bounded, least recently used entries are evicted first.
+    Hits and misses are counted for the lifetime of the object. The cache can be shared
+    between threads.
+    """
+
+    def __init__(self, path:str, max_bytes:int):
+        """
+        Initializes a PersistentCache object.
+
+        Args:
+            path (str): The path of the SQLite file, its directory is created if needed.
+            max_bytes (int): Maximum total size of the stored values.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def get(self, key:str):
+        """
+        Returns a cached value.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            bytes: The value or None if it is not cached.
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys:list):
+        """
+        Returns the cached values of several keys and marks them as recently used.
+
+        Args:
+            keys (list): The keys.
+
+        Returns:
+            list: The value of each key, None for keys that are not cached.
+        """
+        values = {}
+        with self._lock:
+            # stay below the SQLite limit of host parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                values.update(rows)
+            if values:
+                now = time.time()
+                self._connection.executemany("UPDATE cache SET accessed = ? WHERE key = ?", [(now, key) for key in values])
+                self._connection.commit()
+            result = [values.get(key) for key in keys]
+            hits = sum(value is not None for value in result)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return result
+
+    def put(self, key:str, value:bytes):
+        """
+        Stores a value.
+
+        Args:
+            key (str): The key.
+            value (bytes): The value.
+        """
+        self.put_many([(key, value)])
+
+    def put_many(self, items:list):
+        """
+        Stores several values and evicts the least recently used entries above the size bound.
+
+        Args:
+            items (list): (key, value) tuples.
+        """
+        items = [(key, value) for key, value in items if len(value) <= self.max_bytes]
+        if not items:
+            return
+        with self._lock:
+            now = time.time()
+            for key, value in items:
+                row = self._connection.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._size -= row[0]
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), now),
+                )
+                self._size += len(value)
+            self.__evict()
+            self._connection.commit()
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+            self._connection.commit()
+            self._size = 0
+
+    def stats(self):
+        """
+        Returns the usage statistics of the cache.
+
+        Returns:
+            dict: hits, misses, hit rate, number of entries and stored bytes.
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __evict(self):
+        """
+        Deletes the least recently used entries until the size bound holds. Requires the lock.
+        """
+        while self._size > self.max_bytes:
+            rows = self._connection.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 100").fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    return
+                self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._size -= size
@@ -1,6 +1,7 @@
-from typing import List, Any, Dict, TypedDict
+from typing import List, Any, Dict, Iterator, TypedDict
 from io import StringIO, BytesIO
 import requests
+from service.tei_document import TEIDocument, TEI_NS, iterparse_elements
 
 class ElementType(TypedDict):
     """Element type as typed dict."""
@@ -68,18 +69,20 @@ class XMLSentenceSplitter:
         return self.split_text_from_file(StringIO(text))
 
     def split_text_from_file(self, file: Any) -> List[str]:
-        try:
-            from lxml import etree
-        except ImportError as e:
-            raise ImportError(
-                "Unable to import lxml, please install with `pip install lxml`."
-            ) from e
+        """Split HTML/XML from a file path or file-like object
 
-        parser = etree.XMLParser(encoding="utf-8")
-        tree = etree.parse(file, parser)
+        Args:
+            file: path of the file or a file-like object
+        """
+        return self.split_document(TEIDocument.from_file(file))
 
-        # Define namespace mappings
-        ns = {"tei": "http://www.tei-c.org/ns/1.0"}
+    def split_document(self, document: TEIDocument) -> List[str]:
+        """Split an already parsed TEI document
+
+        Args:
+            document: the parsed document, may be shared with other splitters
+        """
+        from lxml import etree
 
         # Initialize list to store chunks
         chunks = []
@@ -89,7 +92,7 @@ class XMLSentenceSplitter:
             # Retrieve elements based on the current tag
             tag_name = tag[0]
             xpath_expr = f'//tei:{tag_name}'
-            elements = tree.xpath(xpath_expr, namespaces=ns)
+            elements = document.xpath(xpath_expr)
             
             # Loop through each element and add it as a new chunk
             for element in elements:
@@ -98,6 +101,26 @@ class XMLSentenceSplitter:
 
         return chunks
 
+    def iter_split_document(self, document: TEIDocument) -> Iterator[str]:
+        """Split a TEI document in bounded memory
+
+        The raw document is parsed incrementally once per tag instead of building
+        the whole tree, elements are yielded as soon as they are complete. The
+        chunks are the same as the ones of `split_document`.
+
+        Args:
+            document: the document to split, its tree is not used
+        """
+        from lxml import etree
+
+        for tag in self.tags_to_split_on:
+            tag_name = tag[0]
+            for element in iterparse_elements(document.open(), tag_name):
+                yield etree.tostring(element, encoding=str)
+                # nested elements of the same tag follow their ancestor, as in document order
+                for nested_element in element.xpath(f'.//tei:{tag_name}', namespaces=TEI_NS):
+                    yield etree.tostring(nested_element, encoding=str)
+
 
 
 # Example usage:
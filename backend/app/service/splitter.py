@@ -2,43 +2,17 @@ from langchain_text_splitters import (
     Language,
     RecursiveCharacterTextSplitter,
 )
-import os
-from dotenv import load_dotenv, find_dotenv
-from tempfile import NamedTemporaryFile
-import requests
+import threading
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
+from service.embedding_cache import get_embedding_cache
+from service.etc.settings import get_setting
+from service.ollama_connection import get_ollama_connection
 from service.xml_tag_splitter import XMLTagTextSplitter
 from service.sentence_splitter import XMLSentenceSplitter
-from service.weaviate_connection import WeaviateConnection
-
-def __save_uploaded_file(uploaded_file:bytes):
-    """
-    Saves the uploaded file to a temporary location on the server.
-
-    Parameters
-    ----------
-
-    uploaded_file (BytesIO): The uploaded file object.
-
-    Returns
-    -------
-    str: The file path where the uploaded file is saved.
-    """
-    
-    with NamedTemporaryFile(delete=False) as temp_file:
-        temp_file.write(uploaded_file)
-        file_path = temp_file.name
-    return file_path
-
-def __delete_file(file_path:str):
-    """
-    Deletes the file from the server.
-
-    Parameters
-    ----------    
-    file_path (str): The path of the file to be deleted.
-    """
-    os.remove(file_path)
+from service.tei_document import TEIDocument
+from service.ttl_cache import TTLCache
+from service.weaviate_connection import get_weaviate_connection
 
 def __get_html_splitter(chunk_size:int, chunk_overlap:int):
     splitter = RecursiveCharacterTextSplitter.from_language(
@@ -55,14 +29,14 @@ def __get_sentence_splitter():
     tag_splitter = XMLSentenceSplitter(tags_to_split_on=tags_to_split_on)
     return tag_splitter
 
-def __get_docs_from_structure_splitter(chunk_size:int, file_path:str):
+def __get_docs_from_structure_splitter(chunk_size:int, document:TEIDocument):
 
     text_splitter = XMLTagTextSplitter(first_tag="div", second_tag="p", max_chunk_size=chunk_size)
 
     table_splitter = XMLTagTextSplitter(first_tag="figure", second_tag="row", max_chunk_size=chunk_size)
 
-    docs = text_splitter.split_text_from_file(file_path)
-    docs.extend(table_splitter.split_text_from_file(file_path))
+    docs = text_splitter.split_document(document)
+    docs.extend(table_splitter.split_document(document))
 
     return docs
 
@@ -82,75 +56,221 @@ def load_and_split_text(text:str, chunk_size:int, chunk_overlap:int, splitter_ty
     List[str]: a list of document chunks.
     """
 
-    file_path = __save_uploaded_file(text)
+    # parse the upload once in memory and share it between all splitters, see iter_split_text for streaming
+    document = TEIDocument(text)
     
     if splitter_type == "XML":
         splitter = __get_html_splitter(chunk_size, chunk_overlap)
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-        docs = splitter.split_text(content)[2:]
+        docs = splitter.split_text(document.text)[2:]
 
     elif splitter_type == "Text Structure":
-        docs = __get_docs_from_structure_splitter(chunk_size, file_path)
+        docs = __get_docs_from_structure_splitter(chunk_size, document)
 
     else:
         splitter = __get_sentence_splitter()
-        docs = splitter.split_text_from_file(file_path)
-
-    __delete_file(file_path)
+        docs = splitter.split_document(document)
 
     return docs
 
-def vectorize_docs(docs:list, vectorizer:str, key:str, title:str = "dummy"):
-    """Retrieve the file splitted in documents with given parameters.
+def iter_split_text(text:bytes, chunk_size:int, chunk_overlap:int, splitter_type:str):
+    """Yield the chunks of the file one by one, as soon as the splitter produces them.
+
+    The structure and sentence splitters parse the file incrementally instead of
+    building the whole tree, so memory stays flat on large documents. The chunks
+    are the same as the ones of load_and_split_text.
+
+    Parameters
+    ----------
+    text (bytes): The uploaded file object.
+    chunk_size (int): size of the resulting chunks.
+    chunk_overlap(int): the size of the chunk overlap.
+    splitter_type (str): the desired way of splitting the text.
+
+    Returns
+    -------
+    Iterator[str]: the document chunks.
+    """
+    document = TEIDocument(text)
+
+    if splitter_type == "XML":
+        splitter = __get_html_splitter(chunk_size, chunk_overlap)
+        yield from splitter.split_text(document.text)[2:]
+
+    elif splitter_type == "Text Structure":
+        text_splitter = XMLTagTextSplitter(first_tag="div", second_tag="p", max_chunk_size=chunk_size)
+        table_splitter = XMLTagTextSplitter(first_tag="figure", second_tag="row", max_chunk_size=chunk_size)
+        yield from text_splitter.iter_split_text_from_file(document.open())
+        yield from table_splitter.iter_split_text_from_file(document.open())
+
+    else:
+        splitter = __get_sentence_splitter()
+        yield from splitter.iter_split_document(document)
+
+def embed_docs(docs:list, vectorizer:str, key:str, progress=None):
+    """Embed the document chunks with the given vectorizer.
+
+    Chunks embedded before with the same vectorizer are served from the embedding cache,
+    only the remaining unique chunks are sent to the embedding model.
 
     Parameters
     ----------
     docs (List[str]): The list of document chunks.
     vectorizer (str): The intended vectorizer to use.
     key(str): The OpenAI key.
-    title(str): The document title.
+    progress (callable, optional): called as progress("embedded", count) when chunks are embedded.
+
+    Returns
+    -------
+    np.ndarray: the vectorized chunks as float32 matrix, one row per chunk.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return __embed_with_model(docs, vectorizer, key, progress)
+
+    cached = cache.get_many(vectorizer, docs)
+    uncached = [doc for doc, embedding in zip(docs, cached) if embedding is None]
+    if progress is not None and len(uncached) < len(docs):
+        progress("embedded", len(docs) - len(uncached))
+    if not uncached:
+        return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+
+    # embed every distinct chunk once
+    missing = list(dict.fromkeys(uncached))
+    new_embeddings = __embed_with_model(missing, vectorizer, key, progress)
+    cache.put_many(vectorizer, missing, new_embeddings)
+    if progress is not None and len(missing) < len(uncached):
+        progress("embedded", len(uncached) - len(missing))
+
+    rows = dict(zip(missing, range(len(missing))))
+    embeddings = np.empty((len(docs), new_embeddings.shape[1]), dtype=np.float32)
+    for i, doc in enumerate(docs):
+        embeddings[i] = new_embeddings[rows[doc]] if cached[i] is None else cached[i]
+    return embeddings
+
+def embed_query(query:str, vectorizer:str, key:str, timeout:float|None = None):
+    """Embed a search query with the given vectorizer.
+
+    Repeated queries are served from an in-memory cache of their own. Uncached queries are
+    embedded with one request that fails on timeout instead of being retried.
+
+    Parameters
+    ----------
+    query (str): The query.
+    vectorizer (str): The vectorizer the searched chunks were embedded with.
+    key(str): The OpenAI key.
+    timeout (float, optional): Seconds to wait for the embedding (QUERY_EMBED_TIMEOUT). Defaults to 2.
 
     Returns
     -------
-    List[number]: the vectorized chunks.
+    np.ndarray: the float32 embedding of the query, read-only as it is shared through the cache.
     """
-    load_dotenv(find_dotenv())
-    ol_url = os.environ.get("OLLAMA_URL")
-    embed_url = ol_url+'/api/embeddings'
-    embeddings = []
+    cache = get_query_embedding_cache()
+    hit, embedding = cache.get((vectorizer, query))
+    if hit:
+        return embedding
 
+    timeout = timeout or get_setting("QUERY_EMBED_TIMEOUT", 2.0, float)
+    if vectorizer == "OpenAI Embeddings":
+        if key is None:
+            raise ValueError
+        embedding_model = OpenAIEmbeddings(model="text-embedding-3-small", api_key=key, timeout=timeout, max_retries=0)
+        embedding = np.asarray(embedding_model.embed_query(query), dtype=np.float32)
+
+    elif vectorizer == "mxbai-embed-large":
+        embedding = get_ollama_connection().embed_query(query, 'mxbai-embed-large', timeout)
+
+    else:
+        embedding = get_ollama_connection().embed_query(query, 'nomic-embed-text', timeout)
+
+    embedding.setflags(write=False)
+    cache.put((vectorizer, query), embedding)
+    return embedding
+
+__query_embedding_cache = None
+__query_embedding_cache_lock = threading.Lock()
+
+def get_query_embedding_cache():
+    """Return the in-process cache of query embeddings.
+
+    Its size and time to live are read from QUERY_EMBEDDING_CACHE_SIZE (1000 entries) and
+    QUERY_EMBEDDING_CACHE_TTL (1 day). It does not depend on EMBEDDING_CACHE.
+
+    Returns
+    -------
+    TTLCache: the shared cache, keyed by vectorizer and query.
+    """
+    global __query_embedding_cache
+    with __query_embedding_cache_lock:
+        if __query_embedding_cache is None:
+            ttl = get_setting("QUERY_EMBEDDING_CACHE_TTL", 86400.0, float)
+            __query_embedding_cache = TTLCache(max_size=get_setting("QUERY_EMBEDDING_CACHE_SIZE", 1000, int), ttl=ttl, negative_ttl=ttl)
+        return __query_embedding_cache
+
+def __embed_with_model(docs:list, vectorizer:str, key:str, progress=None):
+    """Embed the document chunks with the embedding model of the vectorizer.
+
+    Parameters
+    ----------
+    docs (List[str]): The list of document chunks.
+    vectorizer (str): The intended vectorizer to use.
+    key(str): The OpenAI key.
+    progress (callable, optional): called as progress("embedded", count) when chunks are embedded.
+
+    Returns
+    -------
+    np.ndarray: the vectorized chunks as float32 matrix, one row per chunk.
+    """
     if vectorizer == "OpenAI Embeddings":
         if key is None:
             raise ValueError
         embedding_model = OpenAIEmbeddings(model="text-embedding-3-small",api_key=key)
-        embeddings = embedding_model.embed_documents(texts=docs)
+        embeddings = np.asarray(embedding_model.embed_documents(texts=docs), dtype=np.float32)
         #embedding = embedding_model.embed_query(docs[0])
+        if progress is not None:
+            progress("embedded", len(docs))
 
     elif vectorizer == "mxbai-embed-large":
-        if ol_url is None:
-            raise ValueError
-        for doc in docs:
-            body = {'model': 'mxbai-embed-large',
-                    'prompt': doc,
-                    'stream': False
-                    }  
-            response = requests.post(embed_url, json = body)
-            embedding = response.json()["embedding"]
-            embeddings.append(embedding)
+        embeddings = get_ollama_connection().embed(docs, 'mxbai-embed-large', progress)
         
     else:
-        if ol_url is None:
-            raise ValueError
-        for doc in docs:
-            body = {'model': 'nomic-embed-text',
-                    'prompt': doc,
-                    'stream': False}  
-            response = requests.post(embed_url, json = body)
-            embedding = response.json()["embedding"]
-            embeddings.append(embedding)
+        embeddings = get_ollama_connection().embed(docs, 'nomic-embed-text', progress)
 
-    # send embeddings to database
-    weaviate = WeaviateConnection()
-    weaviate.store_embeddings(embeddings=embeddings, chunks=docs, title=title, vectorizer=vectorizer)
+    return embeddings
+
+def store_docs(docs:list, embeddings:list, vectorizer:str, title:str = "dummy", progress=None):
+    """Store the document chunks and their embeddings in the database.
+
+    Parameters
+    ----------
+    docs (List[str]): The list of document chunks.
+    embeddings (np.ndarray): The embedding of each chunk, one row per chunk.
+    vectorizer (str): The vectorizer used for the embeddings.
+    title(str): The document title.
+    progress (callable, optional): called as progress("stored", count) when chunks are stored.
+
+    Returns
+    -------
+    StoreResult: the number of stored chunks and the chunks that failed.
+    """
+    weaviate = get_weaviate_connection()
+    return weaviate.store_embeddings(embeddings=embeddings, chunks=docs, title=title, vectorizer=vectorizer, progress=progress)
 
+def vectorize_docs(docs:list, vectorizer:str, key:str, title:str = "dummy", progress=None):
+    """Embed the document chunks and store them in the database.
+
+    Parameters
+    ----------
+    docs (List[str]): The list of document chunks.
+    vectorizer (str): The intended vectorizer to use.
+    key(str): The OpenAI key.
+    title(str): The document title.
+    progress (callable, optional): called as progress("embedded" | "stored", count) while chunks are processed.
+
+    Returns
+    -------
+    StoreResult: the number of stored chunks and the chunks that failed.
+    """
+    embeddings = embed_docs(docs, vectorizer, key, progress)
+
+    # send embeddings to database
+    return store_docs(docs, embeddings, vectorizer, title, progress)
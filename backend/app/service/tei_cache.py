@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from service.etc.settings import get_setting
+
+class TEICache:
+    """
+    A content-addressed on-disk cache for TEI XML produced by GROBID.
+
+    Entries are keyed by the SHA-256 of the PDF bytes and the GROBID options and stored as
+    one file each. The total size is bounded, least recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_dir:str|None = None, max_bytes:int|None = None):
+        """
+        Initializes a TEICache object. Missing arguments are read from the environment.
+
+        Args:
+            cache_dir (str, optional): Directory of the cache files (GROBID_CACHE_DIR).
+                Defaults to a grobid_tei_cache folder in the temp directory.
+            max_bytes (int, optional): Maximum total size of the cache (GROBID_CACHE_MAX_BYTES). Defaults to 1 GiB.
+        """
+        self.cache_dir = cache_dir or get_setting("GROBID_CACHE_DIR", os.path.join(tempfile.gettempdir(), "grobid_tei_cache"))
+        self.max_bytes = max_bytes if max_bytes is not None else get_setting("GROBID_CACHE_MAX_BYTES", 1024 ** 3, int)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.__load_entries()
+
+    @staticmethod
+    def make_key(pdf_file:bytes, options:dict|None = None):
+        """
+        Computes the cache key of a PDF file parsed with the given GROBID options.
+
+        Args:
+            pdf_file (bytes): The PDF file.
+            options (dict, optional): The GROBID request options.
+
+        Returns:
+            str: The hex digest identifying the TEI output.
+        """
+        digest = hashlib.sha256(pdf_file)
+        digest.update(json.dumps(options or {}, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key:str):
+        """
+        Returns the cached TEI XML and marks it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: The TEI XML or None if it is not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self.__get_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                tei = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.__forget(key)
+            return None
+        return tei
+
+    def put(self, key:str, tei:str):
+        """
+        Stores TEI XML in the cache and evicts the least recently used entries above the size bound.
+
+        Args:
+            key (str): The cache key.
+            tei (str): The TEI XML.
+        """
+        data = tei.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        # write to a temporary file first, so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, self.__get_path(key))
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._size += len(data)
+        self.__evict()
+
+    def __evict(self):
+        """
+        Removes the least recently used entries until the cache is within its size bound.
+        """
+        with self._lock:
+            evicted = []
+            while self._size > self.max_bytes:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.__get_path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def __forget(self, key:str):
+        """
+        Removes an entry whose file disappeared from the index.
+        """
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+
+    def __get_path(self, key:str):
+        """
+        Returns the file path of a cache entry.
+        """
+        return os.path.join(self.cache_dir, f"{key}.tei.xml")
+
+    def __load_entries(self):
+        """
+        Rebuilds the LRU index from the files in the cache directory, oldest access first.
+        """
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".tei.xml"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".tei.xml")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+        # a lower bound than in an earlier run applies right away
+        self.__evict()
+
+__tei_cache = None
+
+def get_tei_cache():
+    """
+    Returns the TEICache shared by the process, or None if caching is disabled (GROBID_CACHE=0).
+
+    Returns:
+        TEICache: The shared cache.
+    """
+    global __tei_cache
+    if __tei_cache is None and get_setting("GROBID_CACHE", 1, int):
+        __tei_cache = TEICache()
+    return __tei_cache
@@ -0,0 +1,126 @@
+from typing import Any, Iterator
+from io import BytesIO
+
+TEI_NAMESPACE = "http://www.tei-c.org/ns/1.0"
+TEI_NS = {"tei": TEI_NAMESPACE}
+
+class TEIDocument:
+    """
+    A TEI/XML document parsed once from its in-memory bytes.
+
+    The raw bytes, the decoded text and the lxml tree are created lazily and kept,
+    so every splitter working on the same upload shares one parse.
+    Requires lxml package.
+    """
+
+    def __init__(self, content: bytes | str):
+        """Create a new TEIDocument.
+
+        Args:
+            content: the TEI/XML document as bytes (as uploaded) or as text.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.raw = content
+        self._text = None
+        self._root = None
+
+    @classmethod
+    def from_file(cls, file: Any) -> "TEIDocument":
+        """Create a TEIDocument from a file path or a file-like object.
+
+        Args:
+            file: path of the file or a file-like object returning bytes or text.
+        """
+        if hasattr(file, "read"):
+            return cls(file.read())
+        with open(file, "rb") as fh:
+            return cls(fh.read())
+
+    @property
+    def text(self) -> str:
+        """The document decoded as utf-8 text."""
+        if self._text is None:
+            self._text = self.raw.decode("utf-8")
+        return self._text
+
+    @property
+    def root(self) -> Any:
+        """The root element of the parsed lxml tree."""
+        if self._root is None:
+            try:
+                from lxml import etree
+            except ImportError as e:
+                raise ImportError(
+                    "Unable to import lxml, please install with `pip install lxml`."
+                ) from e
+
+            parser = etree.XMLParser(encoding="utf-8")
+            self._root = etree.fromstring(self.raw, parser)
+        return self._root
+
+    def xpath(self, expression: str, element: Any = None) -> list:
+        """Evaluate an XPath expression with the tei namespace prefix bound.
+
+        Args:
+            expression: the XPath expression, e.g. `//tei:div`.
+            element: the context element, defaults to the document root.
+        """
+        context = self.root if element is None else element
+        return context.xpath(expression, namespaces=TEI_NS)
+
+    def open(self) -> BytesIO:
+        """Return a fresh binary stream over the raw document, e.g. for incremental parsing."""
+        return BytesIO(self.raw)
+
+def iterparse_elements(file: Any, tag: str) -> Iterator[Any]:
+    """Incrementally parse a TEI file and yield every outermost `tei:<tag>` element.
+
+    Elements are yielded once they are complete, including their tail text. When the
+    consumer asks for the next element, the previous one is cleared and removed from
+    the tree together with its preceding siblings, so memory stays bounded by the
+    largest element instead of the whole document.
+
+    Args:
+        file: path of the file or a file-like object returning bytes.
+        tag: the local name of the elements in the tei namespace.
+    """
+    try:
+        from lxml import etree
+    except ImportError as e:
+        raise ImportError(
+            "Unable to import lxml, please install with `pip install lxml`."
+        ) from e
+
+    events = etree.iterparse(
+        file,
+        events=("start", "end"),
+        tag=f"{{{TEI_NAMESPACE}}}{tag}",
+        encoding="utf-8",
+        huge_tree=True,
+    )
+    depth = 0
+    pending = None
+    for event, element in events:
+        if event == "start":
+            # the tail of a finished element is parsed once the next one starts
+            if pending is not None:
+                yield pending
+                __release(pending)
+                pending = None
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                pending = element
+    if pending is not None:
+        yield pending
+        __release(pending)
+
+def __release(element: Any):
+    """Drop a processed element and its preceding siblings from the tree."""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
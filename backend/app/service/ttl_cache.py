@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    A bounded in-memory LRU cache whose entries expire after a time to live.
+
+    Negative entries remember keys that could not be resolved, they have their own, usually
+    shorter, time to live. The cache can be shared between threads and counts its hits.
+    """
+
+    def __init__(self, max_size:int, ttl:float, negative_ttl:float):
+        """
+        Initializes a TTLCache object.
+
+        Args:
+            max_size (int): Maximum number of entries, least recently used entries are evicted first.
+            ttl (float): Seconds a value stays valid.
+            negative_ttl (float): Seconds a negative entry stays valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Looks a key up.
+
+        Args:
+            key: The key.
+
+        Returns:
+            tuple: (hit, value), value is None for negative entries and misses.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value):
+        """
+        Stores a value.
+
+        Args:
+            key: The key.
+            value: The value, must not be None.
+        """
+        self.__set(key, value, self.ttl)
+
+    def put_negative(self, key):
+        """
+        Remembers that a key could not be resolved.
+
+        Args:
+            key: The key.
+        """
+        self.__set(key, None, self.negative_ttl)
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the usage statistics of the cache.
+
+        Returns:
+            dict: hits, negative hits, misses, hit rate, evictions and number of entries.
+        """
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+    def __set(self, key, value, ttl:float):
+        """
+        Stores an entry and evicts the least recently used ones above the size bound.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
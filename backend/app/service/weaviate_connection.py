@@ -1,14 +1,57 @@
-import os
-from dotenv import load_dotenv, find_dotenv
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, TypedDict
+import httpx
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from service.etc.settings import get_setting
+
+class FailedObject(TypedDict):
+    """An object that could not be stored."""
+
+    position: int
+    error: str
+
+class StoreResult(TypedDict):
+    """Result of storing the chunks of a document."""
+
+    stored: int
+    failed: List[FailedObject]
+
+class KnowledgeLookup(TypedDict):
+    """Result of a bulk knowledge lookup."""
+
+    found: Dict[str, str]
+    missing: List[str]
+
+class ChunkMatch(TypedDict):
+    """A stored chunk found by a similarity search."""
+
+    chunk: str
+    title: str
+    position: int
+    distance: float
+
+class WeaviateQueryError(Exception):
+    """Raised when Weaviate rejects a GraphQL query."""
 
 class WeaviateConnection:
     """
     A class representing a connection to the Weaviate database.
 
     This class provides methods to store embeddings, chunks, and titles in a Weaviate database.
+    Requests go through a keep-alive connection pool, use get_weaviate_connection() to share one
+    connection in the process.
     """
 
+    # schemas checked in this process, as (url, schema_name, schema_name_knowledge)
+    __verified_schemas = set()
+    __verified_schemas_lock = threading.Lock()
+
     def __init__(self, schema_name: str = "Policy", schema_name_knowledge: str = "Policy_Knowledge"):
         """
         Initializes a WeaviateConnection object.
@@ -21,14 +64,65 @@ class WeaviateConnection:
             ValueError: If the Weaviate database does not exist.
         """
         # get from env
-        load_dotenv(find_dotenv())
-        self.weaviate_url = os.environ.get("WEAVIATE_URL")
-        self.weaviate_token = os.environ.get("WEAVIATE_TOKEN")
+        self.weaviate_url = get_setting("WEAVIATE_URL")
+        self.weaviate_token = get_setting("WEAVIATE_TOKEN")
         self.schema_name = schema_name
         self.schema_name_knowledge = schema_name_knowledge
         if not self.weaviate_url or not self.weaviate_token:
             raise ValueError("Weaviate URL or token is missing, please specify in .env file.")
-        # check for database and schema
+        self.pool_size = get_setting("WEAVIATE_POOL_SIZE", 16, int)
+        self.headers = {"Authorization": f"Bearer {self.weaviate_token}"}
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._async_client = None
+        # check for database and schema once per process
+        with WeaviateConnection.__verified_schemas_lock:
+            key = (self.weaviate_url, self.schema_name, self.schema_name_knowledge)
+            if key not in WeaviateConnection.__verified_schemas:
+                self.__check_schemas()
+                WeaviateConnection.__verified_schemas.add(key)
+
+    @property
+    def async_client(self):
+        """
+        The pooled asynchronous HTTP client, created on first use.
+
+        Returns:
+            httpx.AsyncClient: The client, with base URL and authorization set.
+        """
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.weaviate_url,
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._async_client
+
+    def close(self):
+        """
+        Closes the pooled connections of the synchronous client.
+        """
+        self.session.close()
+
+    async def aclose(self):
+        """
+        Closes the pooled connections of both clients.
+        """
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def __check_schemas(self):
+        """
+        Checks that the database exists and creates missing schemas.
+
+        Raises:
+            ValueError: If the Weaviate database does not exist.
+        """
         if not self.__is_existing():
             raise ValueError("Weaviate database does not exist")
         if not self.__is_schema_existing():
@@ -49,31 +143,197 @@ class WeaviateConnection:
             Exception: If there is an error retrieving the knowledge.
 
         Returns:
-            str: The abstract of the policy document.
+            str: The abstract of the policy document or None if it is not stored.
         """
-        try:
-            query = '''
-            {
-              objects(where: {class: "%s", slash_notation: "%s"}) {
-                abstract
-              }
-            }
-            ''' % (self.schema_name_knowledge, slash_notation)
-            payload = {
-                "operationName": "",
-                "query": query,
-                "variables": {}
-            }
-            with requests.Session() as session:
-                response = session.post(f"{self.weaviate_url}/v1/graphql", json=payload, headers={"Authorization": f"Bearer {self.weaviate_token}"})
+        return self.get_knowledge_bulk([slash_notation])["found"].get(slash_notation)
+
+    async def aget_knowledge(self, slash_notation:str):
+        """
+        Retrieves the knowledge from the Weaviate database without blocking the event loop.
+
+        Args:
+            slash_notation (str): The slash notation of the policy document.
+
+        Raises:
+            Exception: If there is an error retrieving the knowledge.
+
+        Returns:
+            str: The abstract of the policy document or None if it is not stored.
+        """
+        return (await self.aget_knowledge_bulk([slash_notation]))["found"].get(slash_notation)
+
+    def get_knowledge_bulk(self, slash_notations, page_size:int = 100) -> KnowledgeLookup:
+        """
+        Retrieves the knowledge of many policy documents with one filtered GraphQL query per page of notations.
+
+        Args:
+            slash_notations (Iterable[str]): The slash notations of the policy documents.
+            page_size (int, optional): Notations per query. Defaults to 100.
+
+        Raises:
+            requests.HTTPError: If the request fails.
+            WeaviateQueryError: If Weaviate rejects the query.
+
+        Returns:
+            KnowledgeLookup: The abstract of every stored notation and the notations that are not stored.
+        """
+        notations = list(dict.fromkeys(slash_notations))
+        found = {}
+        for page in self.__iter_knowledge_pages(notations, page_size):
+            offset = 0
+            while True:
+                response = self.session.post(f"{self.weaviate_url}/v1/graphql", json=self.__get_knowledge_payload(page, offset))
+                response.raise_for_status()
+                objects = self.__read_knowledge_objects(response.json())
+                self.__collect_knowledge(objects, page, found)
+                if len(objects) < self.__get_knowledge_limit(page):
+                    break
+                offset += len(objects)
+        return {"found": found, "missing": [notation for notation in notations if notation not in found]}
+
+    async def aget_knowledge_bulk(self, slash_notations, page_size:int = 100) -> KnowledgeLookup:
+        """
+        Retrieves the knowledge of many policy documents without blocking the event loop.
+
+        Args:
+            slash_notations (Iterable[str]): The slash notations of the policy documents.
+            page_size (int, optional): Notations per query. Defaults to 100.
+
+        Raises:
+            httpx.HTTPStatusError: If the request fails.
+            WeaviateQueryError: If Weaviate rejects the query.
+
+        Returns:
+            KnowledgeLookup: The abstract of every stored notation and the notations that are not stored.
+        """
+        notations = list(dict.fromkeys(slash_notations))
+        found = {}
+        for page in self.__iter_knowledge_pages(notations, page_size):
+            offset = 0
+            while True:
+                response = await self.async_client.post("/v1/graphql", json=self.__get_knowledge_payload(page, offset))
                 response.raise_for_status()
-                response_json = response.json()
-                knowledge = response_json["data"]["objects"][0]["abstract"]
-                return knowledge
-        except Exception:
-            #print(f"Entity not found: {slash_notation}")
-            return None
+                objects = self.__read_knowledge_objects(response.json())
+                self.__collect_knowledge(objects, page, found)
+                if len(objects) < self.__get_knowledge_limit(page):
+                    break
+                offset += len(objects)
+        return {"found": found, "missing": [notation for notation in notations if notation not in found]}
+
+    @staticmethod
+    def __iter_knowledge_pages(notations:list, page_size:int):
+        """
+        Splits the notations into the pages of the bulk lookup.
+        """
+        for i in range(0, len(notations), page_size):
+            yield notations[i:i + page_size]
+
+    @staticmethod
+    def __get_knowledge_limit(page:list):
+        """
+        Returns the number of objects requested per query, leaving room for duplicated entries.
+        """
+        return 2 * len(page)
+
+    def __get_knowledge_payload(self, page:list, offset:int = 0):
+        """
+        Builds the GraphQL request for the knowledge of a page of slash notations.
+
+        Returns:
+            dict: The request payload.
+        """
+        operands = ", ".join(
+            '{path: ["slash_notation"], operator: Equal, valueText: %s}' % json.dumps(notation) for notation in page
+        )
+        query = '''
+        {
+          Get {
+            %s(where: {operator: Or, operands: [%s]}, limit: %d, offset: %d) {
+              slash_notation
+              abstract
+              _additional { id }
+            }
+          }
+        }
+        ''' % (self.schema_name_knowledge, operands, self.__get_knowledge_limit(page), offset)
+        return {
+            "operationName": "",
+            "query": query,
+            "variables": {}
+        }
+
+    def __read_knowledge_objects(self, response_json:dict):
+        """
+        Extracts the knowledge objects from a GraphQL response.
+
+        Raises:
+            WeaviateQueryError: If the response reports errors.
+
+        Returns:
+            list: The returned objects.
+        """
+        if response_json.get("errors"):
+            messages = "; ".join(error.get("message", "") for error in response_json["errors"])
+            raise WeaviateQueryError(f"Knowledge query failed: {messages}")
+        return response_json["data"]["Get"][self.schema_name_knowledge] or []
 
+    @staticmethod
+    def __collect_knowledge(objects:list, page:list, found:dict):
+        """
+        Adds the abstracts of the requested notations to found, ignoring partial token matches.
+        """
+        requested = set(page)
+        for knowledge_object in objects:
+            notation = knowledge_object.get("slash_notation")
+            if notation in requested and notation not in found:
+                found[notation] = knowledge_object.get("abstract")
+
+    def search_chunks(self, vector, vectorizer:str, title:str, limit:int, timeout:float|None = None) -> List[ChunkMatch]:
+        """
+        Finds the chunks of a policy document closest to a vector.
+
+        Args:
+            vector (np.ndarray | list): The query embedding.
+            vectorizer (str): The named vector the chunks were stored with.
+            title (str): The title of the policy document.
+            limit (int): Maximum number of chunks.
+            timeout (float, optional): Seconds to wait for the response (WEAVIATE_QUERY_TIMEOUT). Defaults to 2.
+
+        Raises:
+            requests.HTTPError: If the request fails.
+            WeaviateQueryError: If Weaviate rejects the query.
+
+        Returns:
+            List[ChunkMatch]: The chunks of the document, closest first.
+        """
+        timeout = timeout or get_setting("WEAVIATE_QUERY_TIMEOUT", 2.0, float)
+        query = '''
+        {
+          Get {
+            %s(nearVector: {vector: %s, targetVectors: [%s]}, where: {path: ["title"], operator: Equal, valueText: %s}, limit: %d) {
+              chunk
+              title
+              position
+              _additional { distance }
+            }
+          }
+        }
+        ''' % (self.schema_name, json.dumps(np.asarray(vector, dtype=np.float32).tolist()), json.dumps(vectorizer), json.dumps(title), limit)
+        response = self.session.post(f"{self.weaviate_url}/v1/graphql", json={"operationName": "", "query": query, "variables": {}},
+                                     timeout=timeout)
+        response.raise_for_status()
+        response_json = response.json()
+        if response_json.get("errors"):
+            messages = "; ".join(error.get("message", "") for error in response_json["errors"])
+            raise WeaviateQueryError(f"Chunk search failed: {messages}")
+        objects = response_json["data"]["Get"][self.schema_name] or []
+        # titles stored with word tokenization also match partially
+        return [{
+            "chunk": chunk_object["chunk"],
+            "title": chunk_object["title"],
+            "position": chunk_object["position"],
+            "distance": chunk_object["_additional"]["distance"],
+        } for chunk_object in objects if chunk_object.get("title") == title]
 
     def store_knowledge(self, slash_notation:str, abstract:str):
         """
@@ -98,52 +358,136 @@ class WeaviateConnection:
                 }
             }
             payload = {"objects": [object_props]}
-            with requests.Session() as session:
-                response = session.post(f"{self.weaviate_url}/v1/batch/objects?consistency_level=ALL", 
-                                        json=payload, headers={"Authorization": f"Bearer {self.weaviate_token}"})
-                response.raise_for_status()
+            response = self.session.post(f"{self.weaviate_url}/v1/batch/objects?consistency_level=ALL", json=payload)
+            response.raise_for_status()
         except Exception as e:
             print(f"Error storing knowledge: {e}")  
 
-    def store_embeddings(self, embeddings:list, chunks:list, title:str, vectorizer:str):
+    def replace_knowledge(self, slash_notation:str, abstract:str):
+        """
+        Replaces all stored knowledge objects of a policy document with a new abstract.
+
+        Args:
+            slash_notation (str): The slash notation of the policy document.
+            abstract (str): The new abstract of the policy document.
+
+        Returns:
+            None
+        """
+        try:
+            # deleting shifts the result window, so query again until no object of the notation is left
+            while True:
+                response = self.session.post(f"{self.weaviate_url}/v1/graphql", json=self.__get_knowledge_payload([slash_notation]))
+                response.raise_for_status()
+                ids = [knowledge_object["_additional"]["id"] for knowledge_object in self.__read_knowledge_objects(response.json())
+                       if knowledge_object.get("slash_notation") == slash_notation]
+                if not ids:
+                    break
+                for object_id in ids:
+                    response = self.session.delete(f"{self.weaviate_url}/v1/objects/{self.schema_name_knowledge}/{object_id}")
+                    response.raise_for_status()
+        except Exception as e:
+            print(f"Error deleting knowledge: {e}")
+            return
+        self.store_knowledge(slash_notation, abstract)
+
+    def store_embeddings(self, embeddings:list, chunks:list, title:str, vectorizer:str, batch_size:int|None = None,
+                         max_workers:int|None = None, consistency_level:str|None = None, max_retries:int|None = None,
+                         progress=None) -> StoreResult:
         """
         Stores the embeddings of chunks in the Weaviate database.
 
+        The chunks are sent in several batches at once. Objects rejected by Weaviate, either with
+        the whole request or individually in the batch response, are retried on their own.
+        Missing arguments are read from the environment.
+
         Args:
-            embeddings (list): A list of embeddings corresponding to each chunk.
+            embeddings (np.ndarray | list): The embedding of each chunk, one row per chunk.
             chunks (list): A list of chunks to be stored.
             title (str): The title associated with the chunks.
             vectorizer (str): The name of the vectorizer used to generate the embeddings.
-
-        Raises:
-            Exception: If there is an error storing the embeddings.
+            batch_size (int, optional): Objects per request (WEAVIATE_BATCH_SIZE). Defaults to 100.
+            max_workers (int, optional): Requests in flight at once (WEAVIATE_BATCH_WORKERS). Defaults to 4.
+            consistency_level (str, optional): ONE, QUORUM or ALL (WEAVIATE_CONSISTENCY_LEVEL). Defaults to ALL.
+            max_retries (int, optional): Retries of failed objects (WEAVIATE_BATCH_RETRIES). Defaults to 3.
+            progress (callable, optional): Called as progress("stored", count) after each stored batch.
 
         Returns:
-            None
+            StoreResult: The number of stored chunks and the position and error of every chunk that failed.
         """
-        try:
-            objects = []
-            for i, chunk in enumerate(chunks):
-                object_props = {
-                    "class": self.schema_name,
-                    "properties": {
-                        "chunk": chunk,
-                        "title": title,
-                        "position": i,            
-                    },
-                    "vectors": {
-                        vectorizer: embeddings[i]
-                    }
+        batch_size = batch_size or get_setting("WEAVIATE_BATCH_SIZE", 100, int)
+        max_workers = max_workers or get_setting("WEAVIATE_BATCH_WORKERS", 4, int)
+        consistency_level = consistency_level or get_setting("WEAVIATE_CONSISTENCY_LEVEL", "ALL")
+        max_retries = max_retries if max_retries is not None else get_setting("WEAVIATE_BATCH_RETRIES", 3, int)
+
+        # fixed ids make retried objects overwrite instead of duplicate partially stored ones
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        pending = list(range(len(chunks)))
+        errors = {}
+        stored = 0
+
+        def store_batch(positions):
+            objects = [{
+                "class": self.schema_name,
+                "id": ids[i],
+                "properties": {
+                    "chunk": chunks[i],
+                    "title": title,
+                    "position": i,
+                },
+                "vectors": {
+                    # convert to JSON floats only at the wire boundary
+                    vectorizer: np.asarray(embeddings[i], dtype=np.float32).tolist()
                 }
-                objects.append(object_props)
+            } for i in positions]
+            return positions, self.__post_batch(objects, consistency_level)
 
-            payload = {"objects": objects}
-            with requests.Session() as session:
-                response = session.post(f"{self.weaviate_url}/v1/batch/objects?consistency_level=ALL", 
-                                        json=payload, headers={"Authorization": f"Bearer {self.weaviate_token}"})
-                response.raise_for_status()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for attempt in range(max_retries + 1):
+                errors = {}
+                batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+                for positions, batch_errors in executor.map(store_batch, batches):
+                    errors.update({positions[j]: error for j, error in batch_errors.items()})
+                    succeeded = len(positions) - len(batch_errors)
+                    stored += succeeded
+                    if progress is not None and succeeded:
+                        progress("stored", succeeded)
+                pending = sorted(errors)
+                if not pending:
+                    break
+                if attempt < max_retries:
+                    time.sleep(0.5 * 2 ** attempt)
+
+        for position in pending:
+            print(f"Error storing embedding {position}: {errors[position]}")
+        return {"stored": stored, "failed": [{"position": position, "error": errors[position]} for position in pending]}
+
+    def __post_batch(self, objects:list, consistency_level:str):
+        """
+        Sends one batch of objects to the batch endpoint.
+
+        Args:
+            objects (list): The objects to store.
+            consistency_level (str): The consistency level of the write.
+
+        Returns:
+            dict: The error message for the index of every object that was not stored.
+        """
+        try:
+            response = self.session.post(f"{self.weaviate_url}/v1/batch/objects?consistency_level={consistency_level}",
+                                         json={"objects": objects})
+            response.raise_for_status()
+            results = response.json()
         except Exception as e:
-            print(f"Error storing embeddings: {e}")
+            return {i: str(e) for i in range(len(objects))}
+
+        # the batch endpoint answers 200 and reports errors per object
+        errors = {}
+        for i, result in enumerate(results):
+            object_errors = (result.get("result") or {}).get("errors")
+            if object_errors:
+                errors[i] = "; ".join(error.get("message", "") for error in object_errors.get("error", []))
+        return errors
 
     def __is_existing(self):
         """
@@ -153,10 +497,9 @@ class WeaviateConnection:
             bool: True if the database exists, False otherwise.
         """
         try:
-            with requests.Session() as session:
-                response = session.get(f"{self.weaviate_url}/v1/meta", headers={"Authorization": f"Bearer {self.weaviate_token}"})
-                response.raise_for_status()
-                return True
+            response = self.session.get(f"{self.weaviate_url}/v1/meta")
+            response.raise_for_status()
+            return True
         except Exception as e:
             return False
         
@@ -168,10 +511,9 @@ class WeaviateConnection:
             bool: True if the schema exists, False otherwise.
         """
         try:    
-            with requests.Session() as session:
-                response = session.get(f"{self.weaviate_url}/v1/schema/{schema_name}", headers={"Authorization": f"Bearer {self.weaviate_token}"})  
-                response.raise_for_status()
-                return True
+            response = self.session.get(f"{self.weaviate_url}/v1/schema/{schema_name}")  
+            response.raise_for_status()
+            return True
         except Exception as e:
             return False
         
@@ -183,30 +525,30 @@ class WeaviateConnection:
             None
         """
         try:
-            with requests.Session() as session:
-                schema = {
-                    "class": self.schema_name,
-                    "description": "A policy document",
-                    "properties": [
-                        {
-                            "dataType": ["text"],
-                            "description": "Title of the policy",
-                            "name": "title"
-                        },
-                        {
-                            "dataType": ["text"],
-                            "description": "A chunk of text of the policy document",
-                            "name": "chunk"
-                        },
-                                                {
-                            "dataType": "int",
-                            "description": "The position of the chunk in the policy document",
-                            "name": "position"
-                        },
-                    ]
-                }
-                response = session.post(f"{self.weaviate_url}/v1/schema", json=schema, headers={"Authorization": f"Bearer {self.weaviate_token}"})
-                response.raise_for_status()
+            schema = {
+                "class": self.schema_name,
+                "description": "A policy document",
+                "properties": [
+                    {
+                        "dataType": ["text"],
+                        "description": "Title of the policy",
+                        "name": "title",
+                        "tokenization": "field"
+                    },
+                    {
+                        "dataType": ["text"],
+                        "description": "A chunk of text of the policy document",
+                        "name": "chunk"
+                    },
+                                            {
+                        "dataType": "int",
+                        "description": "The position of the chunk in the policy document",
+                        "name": "position"
+                    },
+                ]
+            }
+            response = self.session.post(f"{self.weaviate_url}/v1/schema", json=schema)
+            response.raise_for_status()
         except Exception as e:
             print(f"Error creating schema: {e}")
 
@@ -218,24 +560,48 @@ class WeaviateConnection:
             None
         """
         try:
-            with requests.Session() as session:
-                schema = {
-                    "class": self.schema_name_knowledge,
-                    "description": "Abstract of a policy document",
-                    "properties": [
-                        {
-                            "dataType": ["text"],
-                            "description": "Slash notation of the policy",
-                            "name": "slash_notation"
-                        },
-                        {
-                            "dataType": ["text"],
-                            "description": "An abstract of the policy document",
-                            "name": "abstract"
-                        },
-                    ]
-                }
-                response = session.post(f"{self.weaviate_url}/v1/schema", json=schema, headers={"Authorization": f"Bearer {self.weaviate_token}"})
-                response.raise_for_status()
+            schema = {
+                "class": self.schema_name_knowledge,
+                "description": "Abstract of a policy document",
+                "properties": [
+                    {
+                        "dataType": ["text"],
+                        "description": "Slash notation of the policy",
+                        "name": "slash_notation",
+                        # match whole notations, "1/2009" must not match "631/2009"
+                        "tokenization": "field"
+                    },
+                    {
+                        "dataType": ["text"],
+                        "description": "An abstract of the policy document",
+                        "name": "abstract"
+                    },
+                ]
+            }
+            response = self.session.post(f"{self.weaviate_url}/v1/schema", json=schema)
+            response.raise_for_status()
         except Exception as e:
             print(f"Error creating schema: {e}")
+
+__weaviate_connection = None
+__weaviate_connection_lock = threading.Lock()
+
+def get_weaviate_connection():
+    """
+    Returns the WeaviateConnection shared by the process.
+
+    Returns:
+        WeaviateConnection: The shared connection.
+    """
+    global __weaviate_connection
+    with __weaviate_connection_lock:
+        if __weaviate_connection is None:
+            __weaviate_connection = WeaviateConnection()
+        return __weaviate_connection
+
+async def close_weaviate_connection():
+    """
+    Closes the WeaviateConnection shared by the process, if it was created.
+    """
+    if __weaviate_connection is not None:
+        await __weaviate_connection.aclose()
@@ -1,6 +1,7 @@
-from typing import List, Any, Dict, TypedDict
+from typing import List, Any, Dict, Iterable, Iterator, TypedDict
 from io import StringIO, BytesIO
 import requests
+from service.tei_document import TEIDocument, TEI_NS, iterparse_elements
 
 class ElementType(TypedDict):
     """Element type as typed dict."""
@@ -74,67 +75,93 @@ class XMLTagTextSplitter:
         return self.split_text_from_file(StringIO(text))
 
     def split_text_from_file(self, file: Any) -> List[str]:
-        try:
-            from lxml import etree
-        except ImportError as e:
-            raise ImportError(
-                "Unable to import lxml, please install with `pip install lxml`."
-            ) from e
+        """Split HTML/XML from a file path or file-like object
 
-        parser = etree.XMLParser(encoding="utf-8")
-        tree = etree.parse(file, parser)
-
-        # Define namespace mappings
-        ns = {"tei": "http://www.tei-c.org/ns/1.0"}
+        Args:
+            file: path of the file or a file-like object
+        """
+        return self.split_document(TEIDocument.from_file(file))
 
-        # Initialize list to store chunks
-        chunks = []
+    def split_document(self, document: TEIDocument) -> List[str]:
+        """Split an already parsed TEI document
 
+        Args:
+            document: the parsed document, may be shared with other splitters
+        """
         # Retrieve elements based on the first tag
         first_tag_xpath_expr = f'//tei:{self.first_tag}'
-        first_tag_elements = tree.xpath(first_tag_xpath_expr, namespaces=ns)
+        first_tag_elements = document.xpath(first_tag_xpath_expr)
+
+        chunks = (
+            chunk
+            for first_tag_element in first_tag_elements
+            for chunk in self.__split_element(first_tag_element)
+        )
+        return list(self.__merge_chunks(chunks))
 
-        # Loop through each element of the first tag to split on
-        for first_tag_element in first_tag_elements:
-            # Convert the element to a string and get its size
-            first_tag_element_str = etree.tostring(first_tag_element, encoding=str)
-            chunk_size = len(first_tag_element_str)
+    def iter_split_text_from_file(self, file: Any) -> Iterator[str]:
+        """Split HTML/XML from a file path or file-like object in bounded memory
 
-            # If the chunk size is smaller than max_chunk_size, add it to chunks
-            if chunk_size <= self.max_chunk_size:
-                chunks.append(first_tag_element_str)
+        The file is parsed incrementally, elements of the first tag are split as
+        soon as they are complete and cleared afterwards, and the merged chunks
+        are yielded while parsing continues. The chunks are the same as the ones
+        of `split_text_from_file`.
+
+        Args:
+            file: path of the file or a file-like object returning bytes
+        """
+        return self.__merge_chunks(self.__iter_element_chunks(file))
+
+    def __iter_element_chunks(self, file: Any) -> Iterator[str]:
+        """Yield the unmerged chunks of each first tag element of a file."""
+        for element in iterparse_elements(file, self.first_tag):
+            yield from self.__split_element(element)
+            # nested first tag elements follow their ancestor, as in document order
+            for nested_element in element.xpath(f'.//tei:{self.first_tag}', namespaces=TEI_NS):
+                yield from self.__split_element(nested_element)
+
+    def __split_element(self, first_tag_element: Any) -> Iterator[str]:
+        """Yield the chunks of a single first tag element."""
+        from lxml import etree
+
+        # Convert the element to a string and get its size
+        first_tag_element_str = etree.tostring(first_tag_element, encoding=str)
+        chunk_size = len(first_tag_element_str)
+
+        # If the chunk size is smaller than max_chunk_size, add it to chunks
+        if chunk_size <= self.max_chunk_size:
+            yield first_tag_element_str
+            return
+
+        # Split the chunk based on the second tag until each chunk size is smaller than max_chunk_size
+        second_tag_xpath_expr = f'.//tei:{self.second_tag}'
+        second_tag_elements = first_tag_element.xpath(second_tag_xpath_expr, namespaces=TEI_NS)
+
+        # Initialize a new chunk
+        current_chunk = first_tag_element_str
+
+        for second_tag_element in second_tag_elements:
+            # Convert the second tag element to a string
+            second_tag_element_str = etree.tostring(second_tag_element, encoding=str).strip()
+            # Check if adding this chunk exceeds max_chunk_size, if not, add it to the current chunk
+            if len(current_chunk) + len(second_tag_element_str) <= self.max_chunk_size:
+                current_chunk += second_tag_element_str
             else:
-                # Split the chunk based on the second tag until each chunk size is smaller than max_chunk_size
-                second_tag_xpath_expr = f'.//tei:{self.second_tag}'
-                second_tag_elements = first_tag_element.xpath(second_tag_xpath_expr, namespaces=ns)
-
-                # Initialize a new chunk
-                current_chunk = first_tag_element_str
-
-                for second_tag_element in second_tag_elements:
-                    # Convert the second tag element to a string
-                    second_tag_element_str = etree.tostring(second_tag_element, encoding=str).strip()
-                    # Check if adding this chunk exceeds max_chunk_size, if not, add it to the current chunk
-                    if len(current_chunk) + len(second_tag_element_str) <= self.max_chunk_size:
-                        current_chunk += second_tag_element_str
-                    else:
-                        # If adding this chunk exceeds max_chunk_size, add the current chunk to chunks and start a new chunk
-                        chunks.append(current_chunk)
-                        current_chunk = second_tag_element_str
-
-                # Add the last chunk to chunks
-                chunks.append(current_chunk)
-
-        # Merge chunks until they reach max_chunk_size
-        merged_chunks = []
+                # If adding this chunk exceeds max_chunk_size, yield the current chunk and start a new chunk
+                yield current_chunk
+                current_chunk = second_tag_element_str
+
+        # Add the last chunk to chunks
+        yield current_chunk
+
+    def __merge_chunks(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Merge consecutive chunks until they reach max_chunk_size."""
         current_merged_chunk = ""
         for chunk in chunks:
             if len(current_merged_chunk) + len(chunk) <= self.max_chunk_size:
                 current_merged_chunk += chunk
             else:
-                merged_chunks.append(current_merged_chunk)
+                yield current_merged_chunk
                 current_merged_chunk = chunk
-        # Add the last merged chunk to the list
-        merged_chunks.append(current_merged_chunk)
-
-        return merged_chunks
+        # Add the last merged chunk
+        yield current_merged_chunk
@@ -0,0 +1,86 @@
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+# the service package is imported relative to backend/app, like in server.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from service.weaviate_connection import WeaviateConnection
+
+@pytest.fixture
+def weaviate(monkeypatch):
+    """
+    Runs a local stand-in for the Weaviate endpoints the connection uses.
+
+    Objects whose position is in `rejected` are refused that many times, the first
+    `failing_requests` batch requests fail as a whole.
+    """
+    state = {"objects": {}, "batches": [], "rejected": {}, "failing_requests": 0, "lock": threading.Lock()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.__send(200, {})
+
+        def do_DELETE(self):
+            with state["lock"]:
+                state["objects"].pop(self.path.rsplit("/", 1)[-1], None)
+            self.__send(204)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path.startswith("/v1/batch/objects"):
+                self.__send(*self.__batch(body["objects"]))
+            elif self.path == "/v1/graphql":
+                self.__send(200, self.__knowledge(body["query"]))
+            else:
+                self.__send(200, {})
+
+        def __batch(self, objects):
+            with state["lock"]:
+                state["batches"].append([batch_object["properties"].get("position") for batch_object in objects])
+                if state["failing_requests"]:
+                    state["failing_requests"] -= 1
+                    return 500, {"error": "unavailable"}
+                results = []
+                for batch_object in objects:
+                    position = batch_object["properties"].get("position")
+                    if state["rejected"].get(position, 0):
+                        state["rejected"][position] -= 1
+                        results.append({"result": {"errors": {"error": [{"message": f"rejected {position}"}]}}})
+                        continue
+                    state["objects"][batch_object.get("id") or str(uuid.uuid4())] = batch_object
+                    results.append({"result": {}})
+                return 200, results
+
+        def __knowledge(self, query):
+            notations = [json.loads(value) for value in re.findall(r'valueText: ("[^"]*")', query)]
+            limit, offset = map(int, re.search(r"limit: (\d+), offset: (\d+)", query).groups())
+            with state["lock"]:
+                matches = [{**stored["properties"], "_additional": {"id": object_id}} for object_id, stored in state["objects"].items()
+                           if stored["properties"].get("slash_notation") in notations]
+            return {"data": {"Get": {"Policy_Knowledge": matches[offset:offset + limit]}}}
+
+        def __send(self, status, payload=None):
+            data = b"" if payload is None else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("WEAVIATE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("WEAVIATE_TOKEN", "token")
+    state["connection"] = WeaviateConnection()
+    yield state
+    state["connection"].close()
+    server.shutdown()
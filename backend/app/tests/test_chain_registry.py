@@ -0,0 +1,43 @@
+import asyncio
+from langchain_core.runnables import RunnableLambda
+from service.chain_registry import ChainRegistry
+
+def test_chain_is_built_once_and_timed():
+    registry = ChainRegistry()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return "prompt", RunnableLambda(lambda x: x * 2)
+
+    prompt, chain = registry.get("double", build)
+    assert registry.get("double", build)[1] is chain
+    assert prompt == "prompt"
+    assert len(builds) == 1
+
+    assert chain.batch([1, 2, 3]) == [2, 4, 6]
+    assert asyncio.run(chain.ainvoke(4)) == 8
+    stats = registry.stats()["double"]
+    assert stats["calls"] == 4
+    assert stats["failures"] == 0
+
+def test_failures_are_counted():
+    registry = ChainRegistry()
+
+    def fail(x):
+        raise ValueError(x)
+
+    chain = registry.get("fail", lambda: (None, RunnableLambda(fail)))[1]
+    assert isinstance(chain.batch([1, 2], return_exceptions=True)[0], ValueError)
+    assert registry.stats()["fail"]["failures"] == 2
+
+def test_calls_answered_by_the_wrapper_are_not_timed():
+    registry = ChainRegistry()
+    answers = {1: "cached"}
+
+    def wrap(prompt, chain):
+        return RunnableLambda(lambda x: answers[x] if x in answers else chain.invoke(x))
+
+    chain = registry.get("echo", lambda: (None, RunnableLambda(str)), wrap)[1]
+    assert chain.batch([1, 1, 2]) == ["cached", "cached", "2"]
+    assert registry.stats()["echo"]["calls"] == 1
@@ -0,0 +1,62 @@
+import threading
+import pytest
+from service import eurlex_fetcher
+from service.eurlex_fetcher import EurLexFetcher, get_eurlex_fetcher, set_eurlex_fetcher
+
+class FakeFetcher(EurLexFetcher):
+    def __init__(self, max_workers:int|None = None):
+        super().__init__(max_workers)
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.barrier = threading.Barrier(2, timeout=5)
+        self.lock = threading.Lock()
+
+    def fetch_html(self, slash_notation:str):
+        with self.lock:
+            self.calls.append(slash_notation)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if slash_notation == "missing":
+                raise FileNotFoundError(slash_notation)
+            self.barrier.wait()
+            return f"<html>{slash_notation}</html>"
+        finally:
+            with self.lock:
+                self.running -= 1
+
+@pytest.fixture
+def restore_fetcher():
+    previous = vars(eurlex_fetcher)["__eurlex_fetcher"]
+    yield
+    vars(eurlex_fetcher)["__eurlex_fetcher"] = previous
+
+def test_fetcher_is_abstract():
+    with pytest.raises(TypeError):
+        EurLexFetcher()
+
+def test_fetch_many_resolves_each_notation_once_in_parallel():
+    fetcher = FakeFetcher(max_workers=2)
+    try:
+        results = fetcher.fetch_many(["1/2000", "2/2000", "1/2000", "missing"])
+    finally:
+        fetcher.close()
+
+    assert results["1/2000"] == "<html>1/2000</html>"
+    assert results["2/2000"] == "<html>2/2000</html>"
+    assert isinstance(results["missing"], FileNotFoundError)
+    assert sorted(fetcher.calls) == ["1/2000", "2/2000", "missing"]
+    # the barrier only opens when both notations are fetched at the same time
+    assert fetcher.max_running == 2
+
+def test_set_fetcher_closes_the_previous_one(restore_fetcher):
+    first = FakeFetcher(max_workers=1)
+    second = FakeFetcher(max_workers=1)
+    set_eurlex_fetcher(first)
+    set_eurlex_fetcher(second)
+
+    assert get_eurlex_fetcher() is second
+    with pytest.raises(RuntimeError):
+        first._executor.submit(print)
+    second.close()
@@ -0,0 +1,66 @@
+import asyncio
+import httpx
+import pytest
+from service.grobid import GrobidClient
+from service.tei_cache import TEICache
+
+def make_client(handler, cache:TEICache|None = None, **kwargs):
+    client = GrobidClient("http://grobid.invalid", cache=cache, backoff_factor=0.0, **kwargs)
+    client._client = httpx.AsyncClient(base_url=client.grobid_url, transport=httpx.MockTransport(handler))
+    return client
+
+def test_busy_responses_are_retried():
+    statuses = [503, 503, 200]
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(statuses[len(calls) - 1], text="<TEI/>")
+
+    client = make_client(handler, max_retries=3)
+    assert asyncio.run(client.process_fulltext_document(b"%PDF")) == "<TEI/>"
+    assert len(calls) == 3
+
+def test_errors_are_raised_after_the_last_retry():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    client = make_client(handler, max_retries=1)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(client.process_fulltext_document(b"%PDF"))
+    assert len(calls) == 2
+
+def test_requests_in_flight_are_bounded():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, text="<TEI/>")
+
+    client = make_client(handler, max_concurrency=2)
+
+    async def parse_all():
+        return await asyncio.gather(*(client.process_fulltext_document(b"%PDF" + bytes([i])) for i in range(6)))
+
+    assert asyncio.run(parse_all()) == ["<TEI/>"] * 6
+    assert max_in_flight == 2
+
+def test_parsed_documents_are_served_from_the_cache(tmp_path):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, text="<TEI>parsed</TEI>")
+
+    client = make_client(handler, cache=TEICache(str(tmp_path)))
+    for _ in range(2):
+        assert asyncio.run(client.process_fulltext_document(b"%PDF", {"consolidateHeader": "1"})) == "<TEI>parsed</TEI>"
+    assert len(calls) == 1
@@ -0,0 +1,73 @@
+import asyncio
+import io
+import os
+import numpy as np
+import pytest
+from service import ingestion
+from service.ingestion import IngestionPipeline, spool_upload
+from service.jobs import Job
+
+class FakeGrobidClient:
+    def __init__(self, max_concurrency:int):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.stages = []
+
+    async def process_fulltext_document(self, pdf_file:bytes, options:dict|None = None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.stages.append([item["stage"] for item in self.job.items])
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if pdf_file == b"broken":
+            raise ValueError("GROBID could not parse the PDF")
+        return pdf_file.decode()
+
+@pytest.fixture
+def stages(monkeypatch):
+    monkeypatch.setattr(ingestion, "load_and_split_text", lambda tei, *args: [tei, tei])
+    monkeypatch.setattr(ingestion, "embed_docs", lambda chunks, vectorizer, key: np.zeros((len(chunks), 2), dtype=np.float32))
+    monkeypatch.setattr(ingestion, "store_docs", lambda chunks, embeddings, vectorizer, title: {"stored": len(chunks), "failed": []})
+
+def spool(content:bytes):
+    return spool_upload(io.BytesIO(content))
+
+def test_spool_upload_copies_the_file():
+    path = spool(b"%PDF-1.7")
+    try:
+        with open(path, "rb") as file:
+            assert file.read() == b"%PDF-1.7"
+    finally:
+        os.remove(path)
+
+def test_pipeline_parses_within_the_grobid_limit(stages):
+    client = FakeGrobidClient(max_concurrency=2)
+    files = [(f"doc {i}", spool(f"tei {i}".encode())) for i in range(5)]
+    job = Job("batch_ingestion", items=[{"title": title, "stage": "queued"} for title, _ in files])
+    client.job = job
+
+    asyncio.run(IngestionPipeline(client, 1, 1, 1).run(job, files, 100, 0, "XML", "nomic-embed-text"))
+
+    assert job.status == "completed"
+    assert job.progress == {"completed": 5}
+    assert [item["stage"] for item in job.items] == ["done"] * 5
+    assert [item["chunks"] for item in job.items] == [2] * 5
+    assert client.max_in_flight == 2
+    # documents wait as queued until they hold a GROBID slot
+    assert all(snapshot.count("parsing") <= 2 for snapshot in client.stages)
+    assert client.stages[0].count("queued") == 3
+    assert not any(os.path.exists(path) for _, path in files)
+
+def test_pipeline_records_failed_documents(stages):
+    client = FakeGrobidClient(max_concurrency=4)
+    files = [("good", spool(b"tei")), ("broken", spool(b"broken"))]
+    job = Job("batch_ingestion", items=[{"title": title, "stage": "queued"} for title, _ in files])
+    client.job = job
+
+    asyncio.run(IngestionPipeline(client).run(job, files, 100, 0, "XML", "nomic-embed-text"))
+
+    assert job.status == "completed"
+    assert job.progress == {"completed": 1, "failed": 1}
+    assert job.items[1] == {"title": "broken", "stage": "failed", "error": "GROBID could not parse the PDF"}
+    assert not any(os.path.exists(path) for _, path in files)
@@ -0,0 +1,50 @@
+import threading
+from service.jobs import Job, JobRegistry, run_in_background
+
+def test_registry_drops_finished_jobs_first():
+    registry = JobRegistry(max_jobs=2)
+    finished = registry.create("embeddings")
+    finished.complete()
+    running = registry.create("embeddings")
+    running.start()
+    newest = registry.create("embeddings")
+
+    assert registry.get(finished.id) is None
+    assert registry.get(running.id) is running
+    assert registry.get(newest.id) is newest
+
+def test_background_job_records_result_and_progress():
+    job = Job("embeddings", progress={"total": 3, "embedded": 0})
+
+    def work(count, progress):
+        for _ in range(count):
+            progress("embedded")
+        return {"stored": count}
+
+    run_in_background(job, work, 3, job.increment).result(timeout=5)
+
+    state = job.to_dict(include_result=True)
+    assert state["status"] == "completed"
+    assert state["progress"] == {"total": 3, "embedded": 3}
+    assert state["result"] == {"stored": 3}
+
+def test_background_job_records_failure():
+    job = Job("embeddings")
+
+    def work():
+        raise ValueError("Weaviate is down")
+
+    run_in_background(job, work).result(timeout=5)
+
+    assert job.status == "failed"
+    assert job.error == "Weaviate is down"
+
+def test_concurrent_increments_are_counted():
+    job = Job("embeddings")
+    threads = [threading.Thread(target=lambda: [job.increment("stored") for _ in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert job.progress["stored"] == 8000
@@ -0,0 +1,102 @@
+import uuid
+import pytest
+from service import knowledge_injection
+from service.ttl_cache import TTLCache
+
+get_abstract = getattr(knowledge_injection, "__get_abstract")
+create_knowledge_dict = getattr(knowledge_injection, "__create_knowledge_dict")
+
+OLD_FORMAT = """
+<html><body>
+<p class="ti-art">Article 1</p>
+<p class="sti-art">Subject matter</p>
+<p class="normal">This Regulation lays down requirements.</p>
+<p class="ti-art">Article 2</p>
+<p class="normal">Definitions follow.</p>
+</body></html>
+"""
+
+OJ_FORMAT = """
+<html><body>
+<div class="eli-subdivision" id="art_1">
+<p class="oj-ti-art">Article&nbsp;1</p>
+<div class="eli-title" id="art_1.tit_1"><p class="oj-sti-art">Subject matter</p></div>
+<div id="001.001"><p class="oj-normal">This Regulation lays down requirements.</p></div>
+</div>
+<div class="eli-subdivision" id="art_2">
+<p class="oj-ti-art">Article&nbsp;2</p>
+<div class="eli-title" id="art_2.tit_1"><p class="oj-sti-art">Definitions</p></div>
+</div>
+</body></html>
+"""
+
+CONSOLIDATED_FORMAT = """
+<html><body>
+<div class="eli-subdivision" id="art_1">
+<p class="title-article-norm">Article 1</p>
+<div class="eli-title"><p class="stitle-article-norm">Subject matter</p></div>
+<div class="norm"><p class="norm">This Regulation lays down requirements.</p></div>
+</div>
+<div class="eli-subdivision" id="art_2">
+<p class="title-article-norm">ARTICLE 2</p>
+</div>
+</body></html>
+"""
+
+def test_get_abstract_skips_article_titles():
+    for html in (OLD_FORMAT, OJ_FORMAT, CONSOLIDATED_FORMAT):
+        assert get_abstract(html) == "This Regulation lays down requirements."
+
+def test_get_abstract_keeps_first_paragraph_without_title():
+    html = "<p>Article 1</p><p>This Regulation lays down requirements.</p><p>Article 2</p>"
+    assert get_abstract(html) == "This Regulation lays down requirements."
+
+def test_get_abstract_without_article_returns_placeholder():
+    assert get_abstract("<p>Nothing here</p>") == knowledge_injection.DEFAULT_ABSTRACT
+
+class FakeFetcher:
+    def __init__(self, pages:dict):
+        self.pages = pages
+        self.requested = []
+
+    def fetch_many(self, slash_notations:list):
+        self.requested.extend(slash_notations)
+        return {notation: self.pages.get(notation, FileNotFoundError(notation)) for notation in slash_notations}
+
+@pytest.fixture
+def knowledge(weaviate, monkeypatch):
+    fetcher = FakeFetcher({"78/2009": OJ_FORMAT})
+    monkeypatch.setattr(knowledge_injection, "get_weaviate_connection", lambda: weaviate["connection"])
+    monkeypatch.setattr(knowledge_injection, "get_eurlex_fetcher", lambda: fetcher)
+    monkeypatch.setitem(vars(knowledge_injection), "__knowledge_cache", TTLCache(max_size=100, ttl=60.0, negative_ttl=60.0))
+    weaviate["fetcher"] = fetcher
+    return weaviate
+
+def stored_abstracts(weaviate, slash_notation:str):
+    return [stored["properties"]["abstract"] for stored in weaviate["objects"].values()
+            if stored["properties"]["slash_notation"] == slash_notation]
+
+def test_stored_placeholders_are_refetched_and_replaced(knowledge):
+    for _ in range(2):
+        knowledge["objects"][str(uuid.uuid4())] = {"class": "Policy_Knowledge", "properties": {"slash_notation": "78/2009", "abstract": knowledge_injection.DEFAULT_ABSTRACT}}
+
+    knowledge_dict = create_knowledge_dict(["78/2009"])
+
+    assert knowledge_dict == {"78/2009": "This Regulation lays down requirements."}
+    assert knowledge["fetcher"].requested == ["78/2009"]
+    assert stored_abstracts(knowledge, "78/2009") == ["This Regulation lays down requirements."]
+
+def test_unresolved_notations_are_not_stored(knowledge):
+    assert create_knowledge_dict(["1/2000", "1/2000"]) == {"1/2000": knowledge_injection.DEFAULT_ABSTRACT}
+    # the negative entry answers the second lookup
+    assert create_knowledge_dict(["1/2000"]) == {"1/2000": knowledge_injection.DEFAULT_ABSTRACT}
+
+    assert knowledge["fetcher"].requested == ["1/2000"]
+    assert knowledge["objects"] == {}
+
+def test_fetched_abstracts_are_stored_once(knowledge):
+    create_knowledge_dict(["78/2009"])
+    create_knowledge_dict(["78/2009"])
+
+    assert knowledge["fetcher"].requested == ["78/2009"]
+    assert stored_abstracts(knowledge, "78/2009") == ["This Regulation lays down requirements."]
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from langchain_core.runnables import RunnableLambda
+from service import language_model_connection
+from service.language_model_connection import LanguageModel, LanguageModelConnection, get_language_model_connection, get_tokenizer
+from service.llm_cache import LLMCache
+
+def make_connection(respond, bypass_cache:bool = True):
+    """
+    Returns a connection whose language model answers every prompt with respond(prompt text).
+    """
+    connection = LanguageModelConnection(LanguageModel.GPT_3_5, "sk-test", bypass_cache=bypass_cache)
+    connection.llm = RunnableLambda(lambda prompt: json.dumps(respond(prompt.to_string())))
+    return connection
+
+@pytest.fixture
+def connections(monkeypatch):
+    monkeypatch.setitem(vars(language_model_connection), "__connections", type(vars(language_model_connection)["__connections"])())
+    return vars(language_model_connection)["__connections"]
+
+def test_connection_cache_drops_least_recently_used(connections, monkeypatch):
+    monkeypatch.setenv("LLM_CONNECTION_CACHE_SIZE", "2")
+    first = get_language_model_connection(LanguageModel.GPT_3_5, "sk-1")
+    second = get_language_model_connection(LanguageModel.GPT_3_5, "sk-2")
+    assert get_language_model_connection(LanguageModel.GPT_3_5, "sk-1") is first
+    get_language_model_connection(LanguageModel.GPT_3_5, "sk-3")
+
+    assert len(connections) == 2
+    assert get_language_model_connection(LanguageModel.GPT_3_5, "sk-1") is first
+    assert get_language_model_connection(LanguageModel.GPT_3_5, "sk-2") is not second
+    assert all("sk-" not in str(key) for key in connections)
+
+def test_cache_hits_are_not_counted_as_chain_calls(monkeypatch, tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(language_model_connection, "get_llm_cache", lambda: cache)
+    connection = make_connection(lambda prompt: {"summary": "short"}, bypass_cache=False)
+
+    for _ in range(3):
+        assert connection.generate_chunk_summary("a chunk")["summary"] == "short"
+
+    assert connection.chain_stats()["chunk_summary"]["calls"] == 1
+
+class FlakyModel:
+    """
+    Summarizes chunks named "chunk <n>", slower for lower n, and fails the first
+    failures[n] calls of a chunk.
+    """
+
+    def __init__(self, failures:dict|None = None):
+        self.failures = dict(failures or {})
+        self.calls = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt:str):
+        chunk = prompt.split("The Chunk: ")[-1].strip()
+        number = int(chunk.split()[-1])
+        with self.lock:
+            self.calls[number] = self.calls.get(number, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.002 * (10 - number % 10))
+            with self.lock:
+                if self.failures.get(number, 0):
+                    self.failures[number] -= 1
+                    raise RuntimeError(f"rate limited {number}")
+            return {"stakeholder": [], "key_information": [], "chunk_summary": f"summary {number}"}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_BACKOFF", "0")
+
+def test_chunk_summaries_keep_the_chunk_order(no_backoff):
+    model = FlakyModel()
+    connection = make_connection(model)
+
+    summaries = connection.generate_chunk_summaries([f"chunk {i}" for i in range(10)], max_concurrency=3)
+
+    assert [summary["chunk_summary"] for summary in summaries] == [f"summary {i}" for i in range(10)]
+    assert model.max_in_flight <= 3
+
+def test_only_failed_chunks_are_retried(no_backoff):
+    model = FlakyModel({2: 1, 5: 2})
+    connection = make_connection(model)
+
+    summaries = connection.generate_chunk_summaries([f"chunk {i}" for i in range(6)], max_retries=2)
+
+    assert [summary["chunk_summary"] for summary in summaries] == [f"summary {i}" for i in range(6)]
+    assert model.calls == {0: 1, 1: 1, 2: 2, 3: 1, 4: 1, 5: 3}
+
+def test_error_is_raised_after_the_last_retry(no_backoff):
+    model = FlakyModel({1: 3})
+    connection = make_connection(model)
+
+    with pytest.raises(RuntimeError, match="rate limited 1"):
+        connection.generate_chunk_summaries([f"chunk {i}" for i in range(3)], max_retries=2)
+    assert model.calls == {0: 1, 1: 3, 2: 1}
+
+def test_async_chunk_summaries_retry_and_keep_the_order(no_backoff):
+    model = FlakyModel({3: 1})
+    connection = make_connection(model)
+
+    summaries = asyncio.run(connection.agenerate_chunk_summaries([f"chunk {i}" for i in range(8)], max_concurrency=2))
+
+    assert [summary["chunk_summary"] for summary in summaries] == [f"summary {i}" for i in range(8)]
+    assert model.calls[3] == 2
+    assert model.max_in_flight <= 2
+
+def test_streamed_chunk_summaries_cover_every_chunk_once(no_backoff):
+    model = FlakyModel({0: 1})
+    connection = make_connection(model)
+
+    async def collect():
+        return [item async for item in connection.aiter_chunk_summaries([f"chunk {i}" for i in range(6)], max_concurrency=6)]
+
+    items = asyncio.run(collect())
+
+    assert sorted(position for position, _ in items) == list(range(6))
+    assert all(summary["chunk_summary"] == f"summary {position}" for position, summary in items)
+    # the failed chunk is only yielded by the retry round
+    assert items[-1][0] == 0
+
+class ReduceModel:
+    """
+    Combines summaries by joining them in brackets, compacts partial summaries to their first
+    words and records the size of every prompt in words.
+    """
+
+    def __init__(self, compact_words:int = 3):
+        self.compact_words = compact_words
+        self.prompt_words = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt:str):
+        with self.lock:
+            self.prompt_words.append(len(prompt.split()))
+        if "The summaries:" in prompt:
+            summaries = prompt.split("The summaries:\n")[-1].strip().split("\n\n")
+            return {"summary": "[" + " + ".join(summaries) + "]"}
+        if "at most" in prompt:
+            words = prompt.split("The partial summary:")[-1].split()
+            return {"summary": " ".join(words[:self.compact_words])}
+        chunk_summary = prompt.split("The Chunk summary:")[-1].split("The partial summary:")[0].strip()
+        return {"summary": f" {chunk_summary}"}
+
+def make_word_connection(model:ReduceModel):
+    connection = make_connection(model)
+    # count words, so budgets in the tests are easy to follow
+    connection.count_tokens = lambda text: len(text.split())
+    return connection
+
+def prompt_overhead(connection):
+    prompt = connection._LanguageModelConnection__chain_entry("combine_summary")[0]
+    return connection.count_tokens(prompt.format(summaries="", query=connection.prompts["combine_summary"], knowledge_prompt=connection.prompts["NO_Knowledge"]))
+
+@pytest.mark.parametrize("count, fan_in, calls", [(1, 3, 1), (2, 3, 1), (5, 3, 3), (9, 3, 4), (5, 2, 4)])
+def test_reduce_combines_levels_in_order(count, fan_in, calls):
+    model = ReduceModel()
+    connection = make_word_connection(model)
+    summaries = [f"s{i}" for i in range(count)]
+
+    summary = connection.generate_policy_summary(summaries, "NO", mode="reduce", fan_in=fan_in, max_tokens=10 ** 6)
+
+    assert summary.replace("[", "").replace("]", "").split(" + ") == summaries
+    assert len(model.prompt_words) == calls
+
+def test_async_reduce_matches_the_sync_reduce():
+    summaries = [f"s{i}" for i in range(7)]
+    sync_summary = make_word_connection(ReduceModel()).generate_policy_summary(summaries, "NO", mode="reduce", fan_in=3, max_tokens=10 ** 6)
+
+    assert asyncio.run(make_word_connection(ReduceModel()).agenerate_policy_summary(summaries, "NO", fan_in=3, max_tokens=10 ** 6)) == sync_summary
+
+def test_reduce_keeps_every_call_within_the_budget():
+    model = ReduceModel(compact_words=5)
+    connection = make_word_connection(model)
+    max_tokens = prompt_overhead(connection) + 60
+    long_summary = " ".join(f"w{i}" for i in range(200))
+
+    summary = connection.generate_policy_summary([long_summary, "short", long_summary, "also short"], "NO",
+                                                 mode="reduce", fan_in=4, max_tokens=max_tokens)
+
+    # both long summaries were compacted before they were combined
+    assert summary.count("w0 w1 w2 w3 w4") == 2
+    assert "short" in summary
+    assert max(model.prompt_words) <= max_tokens
+
+def test_reduce_rejects_a_budget_without_room_for_summaries():
+    connection = make_word_connection(ReduceModel())
+
+    with pytest.raises(ValueError):
+        connection.generate_policy_summary(["a", "b"], "NO", mode="reduce", max_tokens=prompt_overhead(connection) + 1)
+
+def test_empty_reduce_returns_an_empty_summary():
+    assert make_word_connection(ReduceModel()).generate_policy_summary([], "NO", mode="reduce") == ""
+
+def test_unknown_summary_mode():
+    with pytest.raises(ValueError):
+        make_word_connection(ReduceModel()).generate_policy_summary(["a"], "NO", mode="tree")
+
+def test_sequential_summary_is_compacted_within_its_budget():
+    model = ReduceModel(compact_words=3)
+    connection = make_word_connection(model)
+    chunk_summaries = [f"point {i} of the policy" for i in range(6)]
+
+    summary = connection.generate_policy_summary(chunk_summaries, "NO", max_summary_tokens=8)
+
+    # every time the running summary grows beyond 8 words it is compacted to 3 words
+    assert connection.count_tokens(summary) <= 8
+    assert len(model.prompt_words) > len(chunk_summaries)
+
+def test_sequential_summary_without_compaction():
+    model = ReduceModel()
+    connection = make_word_connection(model)
+
+    summary = connection.generate_policy_summary(["a", "b", "c"], "NO", max_summary_tokens=100)
+
+    assert summary.split() == ["a", "b", "c"]
+    assert len(model.prompt_words) == 3
+
+def test_tokenizer_is_created_once_per_model():
+    count_tokens = get_tokenizer(LanguageModel.GPT_4)
+
+    assert get_tokenizer(LanguageModel.GPT_4) is count_tokens
+    assert count_tokens("") == 0
+    assert 0 < count_tokens("A regulation on the type-approval of motor vehicles.") < 20
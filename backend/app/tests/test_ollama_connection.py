@@ -0,0 +1,64 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pytest
+import requests
+from service.ollama_connection import OllamaConnection
+
+@pytest.fixture
+def ollama():
+    """
+    Runs a local embed endpoint that answers the first `failures` requests with 503.
+    """
+    state = {"requests": [], "failures": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            state["requests"].append(body)
+            if len(state["requests"]) <= state["failures"]:
+                self.send_response(503)
+                self.end_headers()
+                return
+            payload = json.dumps({"embeddings": [[float(len(text)), 1.0] for text in body["input"]]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}"
+    yield state
+    server.shutdown()
+
+def test_embed_batches_in_order(ollama):
+    connection = OllamaConnection(ollama["url"], batch_size=2, max_concurrency=3, max_retries=0)
+    docs = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    embeddings = connection.embed(docs, "nomic-embed-text")
+
+    assert embeddings.dtype == np.float32
+    assert embeddings[:, 0].tolist() == [1, 2, 3, 4, 5]
+    assert sorted(len(request["input"]) for request in ollama["requests"]) == [1, 2, 2]
+
+def test_embed_retries_busy_responses(ollama):
+    ollama["failures"] = 2
+    connection = OllamaConnection(ollama["url"], max_retries=3)
+
+    assert connection.embed(["a"], "nomic-embed-text").tolist() == [[1.0, 1.0]]
+    assert len(ollama["requests"]) == 3
+
+def test_embed_query_fails_without_retry(ollama):
+    ollama["failures"] = 1
+    connection = OllamaConnection(ollama["url"], max_retries=3)
+
+    with pytest.raises(requests.HTTPError):
+        connection.embed_query("a", "nomic-embed-text", timeout=1.0)
+    assert len(ollama["requests"]) == 1
+    assert connection.embed_query("abc", "nomic-embed-text", timeout=1.0).tolist() == [3.0, 1.0]
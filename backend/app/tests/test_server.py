@@ -0,0 +1,161 @@
+import json
+import os
+import time
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.runnables import RunnableLambda
+import server
+from service import ingestion, language_model_connection
+from service.ingestion import IngestionPipeline
+from service.language_model_connection import LanguageModel
+
+TEI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tmp", "CELEX_02019R2144-20220905_EN_TXT.pdf.tei.xml")
+
+STREAM_PARAMS = {"chunk_size": 4000, "chunk_overlap": 0, "splitter_type": "XML", "knowledge_level": "NO", "inject_knowledge": False}
+
+def respond(prompt):
+    if "The Chunk:" in prompt:
+        return {"stakeholder": [], "key_information": [], "chunk_summary": "chunk"}
+    return {"summary": "policy"}
+
+def parse_events(body:str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("OLLAMA_URL", "http://ollama.invalid")
+    monkeypatch.setitem(vars(language_model_connection), "__connections", type(vars(language_model_connection)["__connections"])())
+    monkeypatch.setattr(language_model_connection, "get_llm_cache", lambda: None)
+    get_connection = server.get_language_model_connection
+
+    def get_fake_connection(model, key=None):
+        # the real connection is built, only its language model is replaced
+        connection = get_connection(model, key)
+        connection.llm = RunnableLambda(lambda prompt: json.dumps(respond(prompt.to_string())))
+        return connection
+
+    monkeypatch.setattr(server, "get_language_model_connection", get_fake_connection)
+    return TestClient(server.app)
+
+@pytest.mark.parametrize("model", [language_model.value for language_model in LanguageModel])
+def test_summary_stream_for_each_model(client, model):
+    with open(TEI_PATH, "rb") as file:
+        response = client.post("/summaries/stream", params={**STREAM_PARAMS, "model": model, "openai_key": "sk-test"}, files={"file": file})
+
+    assert response.status_code == 200
+    events = parse_events(response.text)
+    assert events[0][0] == "chunks"
+    total = events[0][1]["total"]
+    assert sorted(data["position"] for event, data in events if event == "chunk_summary") == list(range(total))
+    assert events[-1] == ("summary", {"summary": "policy"})
+
+@pytest.mark.parametrize("params, detail", [
+    ({"model": "gpt-5"}, "Unknown model gpt-5."),
+    ({"knowledge_level": "BASICS"}, "Unknown knowledge level BASICS."),
+    ({"mode": "tree"}, "Unknown summary mode tree."),
+    ({"model": LanguageModel.GPT_4.value, "openai_key": None}, "OpenAI key is required for OpenAI models."),
+])
+def test_summary_stream_rejects_invalid_parameters(client, params, detail):
+    params = {key: value for key, value in {**STREAM_PARAMS, "model": LanguageModel.GPT_3_5.value, "openai_key": "sk-test", **params}.items() if value is not None}
+    response = client.post("/summaries/stream", params=params, files={"file": b"<TEI/>"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail
+
+class FakeGrobidClient:
+    max_concurrency = 2
+
+    async def process_fulltext_document(self, pdf_file:bytes, options:dict|None = None):
+        return pdf_file.decode()
+
+@pytest.fixture
+def batch_client(monkeypatch):
+    monkeypatch.setattr(ingestion, "load_and_split_text", lambda tei, *args: [tei])
+    monkeypatch.setattr(ingestion, "embed_docs", lambda chunks, vectorizer, key: np.zeros((len(chunks), 2), dtype=np.float32))
+    monkeypatch.setattr(ingestion, "store_docs", lambda chunks, embeddings, vectorizer, title: {"stored": len(chunks), "failed": []})
+    monkeypatch.setitem(vars(ingestion), "__ingestion_pipeline", IngestionPipeline(FakeGrobidClient()))
+    with TestClient(server.app) as client:
+        yield client
+
+def test_batch_ingestion_runs_in_the_background(batch_client):
+    files = [("files", (f"policy_{i}.pdf", f"tei {i}".encode(), "application/pdf")) for i in range(3)]
+    params = {"chunk_size": 100, "chunk_overlap": 0, "splitter_type": "XML", "vectorizer": "nomic-embed-text"}
+    response = batch_client.post("/documents/batch", params=params, files=files)
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    for _ in range(100):
+        job = batch_client.get(f"/documents/batch/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.01)
+    assert job["status"] == "completed"
+    assert [(item["title"], item["stage"]) for item in job["items"]] == [(f"policy_{i}.pdf", "done") for i in range(3)]
+
+def test_batch_ingestion_requires_a_key_for_openai(batch_client):
+    params = {"chunk_size": 100, "chunk_overlap": 0, "splitter_type": "XML", "vectorizer": "OpenAI Embeddings"}
+    response = batch_client.post("/documents/batch", params=params, files=[("files", ("policy.pdf", b"tei", "application/pdf"))])
+
+    assert response.status_code == 400
+
+def test_unknown_batch_job(batch_client):
+    assert batch_client.get("/documents/batch/unknown").status_code == 404
+
+@pytest.fixture
+def embeddings_client(monkeypatch):
+    def vectorize_docs(docs, vectorizer, key, title, progress=None):
+        if progress is not None:
+            progress("embedded", len(docs))
+            progress("stored", len(docs))
+        return {"stored": len(docs), "failed": []}
+
+    monkeypatch.setattr(server, "vectorize_docs", vectorize_docs)
+    return TestClient(server.app)
+
+def test_embeddings_in_the_background(embeddings_client):
+    response = embeddings_client.post("/embeddings/", params={"vectorizer": "nomic-embed-text", "background": True}, json=["a", "b"])
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    for _ in range(100):
+        result = embeddings_client.get(f"/embeddings/jobs/{job_id}/result")
+        if result.status_code != 409:
+            break
+        time.sleep(0.01)
+    assert result.status_code == 200
+    job = result.json()
+    assert job["progress"] == {"total": 2, "embedded": 2, "stored": 2}
+    assert job["result"]["stored"] == 2
+    assert embeddings_client.get(f"/embeddings/jobs/{job_id}").json()["status"] == "completed"
+
+def test_embeddings_job_is_not_a_batch_job(embeddings_client):
+    job_id = embeddings_client.post("/embeddings/", params={"vectorizer": "nomic-embed-text", "background": True}, json=["a"]).json()["job_id"]
+
+    assert embeddings_client.get(f"/documents/batch/{job_id}").status_code == 404
+
+def test_embeddings_in_the_request(embeddings_client):
+    response = embeddings_client.post("/embeddings/", params={"vectorizer": "nomic-embed-text"}, json=["a", "b"])
+
+    assert response.status_code == 201
+    assert response.json()["stored"] == 2
+
+@pytest.mark.parametrize("splitter_type", ["XML", "Text Structure", "Sentence"])
+def test_chunks_stream_as_ndjson(splitter_type):
+    params = {"chunk_size": 500, "chunk_overlap": 0, "splitter_type": splitter_type}
+    client = TestClient(server.app)
+    with open(TEI_PATH, "rb") as file:
+        tei = file.read()
+
+    streamed = client.post("/chunks/", params={**params, "stream": True}, files={"file": tei})
+    chunks = client.post("/chunks/", params=params, files={"file": tei}).json()["chunks"]
+
+    assert streamed.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in streamed.text.splitlines()]
+    assert [record["position"] for record in records] == list(range(len(chunks)))
+    assert [record["chunk"] for record in records] == chunks
+    assert all(record["size"] == len(record["chunk"]) for record in records)
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import pytest
+from service import splitter
+from service.sentence_splitter import XMLSentenceSplitter
+from service.embedding_cache import EmbeddingCache
+from service.splitter import embed_docs, embed_query, iter_split_text, load_and_split_text
+from service.tei_document import TEIDocument, iterparse_elements
+from service.ttl_cache import TTLCache
+from service.xml_tag_splitter import XMLTagTextSplitter
+
+TEI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tmp", "CELEX_02019R2144-20220905_EN_TXT.pdf.tei.xml")
+
+SENTENCE_TAGS = [("p", "sentence"), ("figdesc", "figure description"), ("row", "table row")]
+
+NESTED_TEI = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body>
+<div><head>1 Scope</head><p>First paragraph of the scope.</p>
+<div><p>A nested paragraph.</p><p>Another nested paragraph with more words in it.</p></div>tail text
+<p>Last paragraph of the scope.</p></div>
+<div><p>Second section.</p>
+<figure><table><row><cell>a</cell></row><row><cell>b</cell></row></table><figDesc>A figure.</figDesc></figure></div>
+</body></text></TEI>"""
+
+@pytest.fixture(scope="module")
+def tei():
+    with open(TEI_PATH, "rb") as file:
+        return file.read()
+
+class FakeOllama:
+    def __init__(self):
+        self.queries = []
+        self.batches = []
+
+    def embed(self, docs:list, model:str, progress=None):
+        self.batches.append(list(docs))
+        if progress is not None:
+            progress("embedded", len(docs))
+        return np.array([[len(doc), 0.5] for doc in docs], dtype=np.float32)
+
+    def embed_query(self, query:str, model:str, timeout:float):
+        self.queries.append((query, model, timeout))
+        return np.array([len(query), 0.5], dtype=np.float32)
+
+@pytest.fixture
+def ollama(monkeypatch):
+    fake = FakeOllama()
+    monkeypatch.setattr(splitter, "get_ollama_connection", lambda: fake)
+    monkeypatch.setitem(vars(splitter), "__query_embedding_cache", TTLCache(max_size=2, ttl=60.0, negative_ttl=60.0))
+    return fake
+
+def test_query_embeddings_are_cached_without_the_embedding_cache(ollama, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE", "0")
+    monkeypatch.setenv("QUERY_EMBED_TIMEOUT", "0.5")
+
+    first = embed_query("what is regulated?", "mxbai-embed-large", None)
+    second = embed_query("what is regulated?", "mxbai-embed-large", None)
+
+    assert second is first
+    assert not first.flags.writeable
+    assert ollama.queries == [("what is regulated?", "mxbai-embed-large", 0.5)]
+
+def test_query_embeddings_are_cached_per_vectorizer(ollama):
+    embed_query("question", "mxbai-embed-large", None)
+    embed_query("question", "nomic-embed-text", None, timeout=1.0)
+
+    assert [model for _, model, _ in ollama.queries] == ["mxbai-embed-large", "nomic-embed-text"]
+    assert ollama.queries[1][2] == 1.0
+
+def test_tei_document_is_parsed_once(tei):
+    document = TEIDocument(tei)
+
+    assert document.root is document.root
+    assert document.text == tei.decode("utf-8")
+
+@pytest.mark.parametrize("first_tag, second_tag, max_chunk_size", [("div", "p", 500), ("div", "p", 4000), ("figure", "row", 500)])
+def test_structure_splitter_on_shared_document(tei, first_tag, second_tag, max_chunk_size):
+    document = TEIDocument(tei)
+    text_splitter = XMLTagTextSplitter(first_tag=first_tag, second_tag=second_tag, max_chunk_size=max_chunk_size)
+
+    chunks = text_splitter.split_document(document)
+
+    assert chunks
+    assert chunks == text_splitter.split_text_from_file(TEI_PATH)
+    # the second split of a shared document reuses its tree
+    assert text_splitter.split_document(document) == chunks
+
+def test_sentence_splitter_on_shared_document(tei):
+    document = TEIDocument(tei)
+    sentence_splitter = XMLSentenceSplitter(tags_to_split_on=SENTENCE_TAGS)
+
+    chunks = sentence_splitter.split_document(document)
+
+    assert chunks
+    assert chunks == sentence_splitter.split_text(tei.decode("utf-8"))
+
+@pytest.mark.parametrize("splitter_type", ["XML", "Text Structure", "Sentence"])
+def test_splitter_types_produce_chunks(tei, splitter_type):
+    chunks = load_and_split_text(tei, 1000, 100, splitter_type)
+
+    assert chunks
+    assert all(isinstance(chunk, str) and chunk for chunk in chunks)
+
+@pytest.mark.parametrize("splitter_type", ["XML", "Text Structure", "Sentence"])
+@pytest.mark.parametrize("chunk_size", [40, 500, 4000])
+def test_streaming_split_equals_tree_split(tei, splitter_type, chunk_size):
+    assert list(iter_split_text(tei, chunk_size, 0, splitter_type)) == load_and_split_text(tei, chunk_size, 0, splitter_type)
+
+@pytest.mark.parametrize("splitter_type", ["Text Structure", "Sentence"])
+@pytest.mark.parametrize("chunk_size", [10, 40, 1000])
+def test_streaming_split_equals_tree_split_on_nested_elements(splitter_type, chunk_size):
+    chunks = load_and_split_text(NESTED_TEI, chunk_size, 0, splitter_type)
+
+    assert chunks
+    assert list(iter_split_text(NESTED_TEI, chunk_size, 0, splitter_type)) == chunks
+
+def test_iterparse_releases_finished_elements():
+    document = TEIDocument(NESTED_TEI)
+    seen = []
+    for element in iterparse_elements(document.open(), "div"):
+        if seen:
+            # the previous element is cleared once the next one is requested
+            assert len(seen[-1]) == 0
+            assert seen[-1].getparent() is None or seen[-1].getprevious() is None
+        seen.append(element)
+    assert len(seen) == 2
+
+def test_embed_docs_embeds_each_uncached_chunk_once(ollama, monkeypatch, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embedding_cache.sqlite"))
+    monkeypatch.setattr(splitter, "get_embedding_cache", lambda: cache)
+    progress = []
+
+    first = embed_docs(["a", "bb", "a"], "nomic-embed-text", None)
+    second = embed_docs(["bb", "ccc", "ccc", "a"], "nomic-embed-text", None, lambda name, count: progress.append((name, count)))
+
+    assert first.dtype == np.float32
+    assert first[:, 0].tolist() == [1, 2, 1]
+    assert second[:, 0].tolist() == [2, 3, 3, 1]
+    assert ollama.batches == [["a", "bb"], ["ccc"]]
+    assert sum(count for _, count in progress) == 4
+
+def test_embed_docs_caches_per_vectorizer(ollama, monkeypatch, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embedding_cache.sqlite"))
+    monkeypatch.setattr(splitter, "get_embedding_cache", lambda: cache)
+
+    embed_docs(["a"], "nomic-embed-text", None)
+    embed_docs(["a"], "mxbai-embed-large", None)
+
+    assert ollama.batches == [["a"], ["a"]]
@@ -0,0 +1,32 @@
+import os
+from service.tei_cache import TEICache
+
+def test_put_evicts_least_recently_used(tmp_path):
+    cache = TEICache(str(tmp_path), max_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    assert not os.path.exists(tmp_path / "b.tei.xml")
+
+def test_load_evicts_above_a_lower_bound(tmp_path):
+    cache = TEICache(str(tmp_path), max_bytes=100)
+    for key in ("a", "b", "c"):
+        cache.put(key, key * 4)
+        # make the access order visible in the modification times
+        os.utime(tmp_path / f"{key}.tei.xml", (ord(key), ord(key)))
+
+    cache = TEICache(str(tmp_path), max_bytes=8)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "bbbb"
+    assert cache.get("c") == "cccc"
+    assert sorted(os.listdir(tmp_path)) == ["b.tei.xml", "c.tei.xml"]
+
+def test_key_depends_on_options():
+    assert TEICache.make_key(b"pdf") == TEICache.make_key(b"pdf", {})
+    assert TEICache.make_key(b"pdf") != TEICache.make_key(b"pdf", {"consolidateHeader": "1"})
@@ -0,0 +1,50 @@
+import uuid
+import numpy as np
+
+def test_only_rejected_objects_are_resent(weaviate):
+    weaviate["rejected"] = {1: 1, 4: 1}
+    chunks = [f"chunk {i}" for i in range(5)]
+    progress = []
+
+    result = weaviate["connection"].store_embeddings(np.ones((5, 2), dtype=np.float32), chunks, "policy", "nomic-embed-text",
+                                                     batch_size=2, max_workers=2, max_retries=2,
+                                                     progress=lambda name, count: progress.append(count))
+
+    assert result == {"stored": 5, "failed": []}
+    assert sorted(weaviate["batches"][:3]) == [[0, 1], [2, 3], [4]]
+    assert weaviate["batches"][3:] == [[1, 4]]
+    assert sum(progress) == 5
+    # retried objects keep their id, so every chunk is stored once
+    assert sorted(stored["properties"]["position"] for stored in weaviate["objects"].values()) == [0, 1, 2, 3, 4]
+
+def test_failed_requests_are_resent(weaviate):
+    weaviate["failing_requests"] = 1
+
+    result = weaviate["connection"].store_embeddings(np.ones((2, 2), dtype=np.float32), ["a", "b"], "policy", "nomic-embed-text",
+                                                     batch_size=2, max_retries=1)
+
+    assert result == {"stored": 2, "failed": []}
+    assert weaviate["batches"] == [[0, 1], [0, 1]]
+
+def test_objects_rejected_after_all_retries_are_reported(weaviate):
+    weaviate["rejected"] = {0: 5}
+
+    result = weaviate["connection"].store_embeddings(np.ones((2, 2), dtype=np.float32), ["a", "b"], "policy", "nomic-embed-text",
+                                                     batch_size=2, max_retries=1)
+
+    assert result == {"stored": 1, "failed": [{"position": 0, "error": "rejected 0"}]}
+    assert weaviate["batches"] == [[0, 1], [0]]
+
+def store_knowledge_object(weaviate, slash_notation:str, abstract:str):
+    weaviate["objects"][str(uuid.uuid4())] = {"class": "Policy_Knowledge", "properties": {"slash_notation": slash_notation, "abstract": abstract}}
+
+def test_replace_knowledge_removes_every_stored_object(weaviate):
+    for _ in range(3):
+        store_knowledge_object(weaviate, "78/2009", "A policy")
+    store_knowledge_object(weaviate, "631/2009", "Another regulation.")
+
+    weaviate["connection"].replace_knowledge("78/2009", "Type-approval of motor vehicles.")
+
+    lookup = weaviate["connection"].get_knowledge_bulk(["78/2009", "631/2009", "1/2000"])
+    assert lookup == {"found": {"78/2009": "Type-approval of motor vehicles.", "631/2009": "Another regulation."}, "missing": ["1/2000"]}
+    assert len(weaviate["objects"]) == 2